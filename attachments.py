@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import importlib.util
+import io
+import logging
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+import aiohttp
+import config
+
+logger = logging.getLogger(__name__)
+
+# content_type が付かない添付ファイル向けの拡張子判定
+TEXT_EXTENSIONS = ('.txt', '.log', '.md', '.csv', '.tsv', '.json', '.yaml', '.yml', '.xml', '.ini', '.py', '.js', '.ts', '.sh', '.sql')
+PDF_EXTENSIONS = ('.pdf',)
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+def describe_attachment(att):
+    """添付ファイルのメタデータ（discord.py の Attachment / REST APIのdict の両方に対応）"""
+    if isinstance(att, dict):
+        return {
+            'id': str(att['id']),
+            'url': att['url'],
+            'filename': att.get('filename', ''),
+            'size': att.get('size', 0),
+            'content_type': att.get('content_type') or '',
+        }
+    return {
+        'id': str(att.id),
+        'url': att.url,
+        'filename': att.filename,
+        'size': att.size,
+        'content_type': att.content_type or '',
+    }
+
+
+def allowed_kinds():
+    """抽出する種類（ATTACHMENT_TYPES から。pypdf がなければ pdf を除く）"""
+    kinds = [item.strip().lower() for item in config.ATTACHMENT_TYPES.split(',') if item.strip()]
+    if 'pdf' in kinds and importlib.util.find_spec('pypdf') is None:
+        logger.warning("pypdf がインストールされていないため、PDFの添付ファイルは抽出しません（pip install pypdf）")
+        kinds.remove('pdf')
+    return kinds
+
+
+def attachment_kind(filename, content_type, allowed=None):
+    """抽出方法を判定（'text' / 'pdf' / None）"""
+    content_type = content_type.split(';')[0].strip().lower()
+    name = filename.lower()
+    if allowed is None:
+        allowed = allowed_kinds()
+    if content_type == 'application/pdf' or name.endswith(PDF_EXTENSIONS):
+        kind = 'pdf'
+    elif content_type.startswith('text/') or content_type in ('application/json', 'application/xml') or name.endswith(TEXT_EXTENSIONS):
+        kind = 'text'
+    else:
+        return None
+    return kind if kind in allowed else None
+
+
+def extract_text(data, kind):
+    """バイト列からテキストを抽出（プロセスプールで実行）"""
+    if kind == 'pdf':
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            return None
+        reader = PdfReader(io.BytesIO(data))
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+    for encoding in ('utf-8', 'cp932'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+
+class AttachmentCache:
+    """添付ファイルID・内容ハッシュをキーにした抽出結果のキャッシュ（SQLite）"""
+
+    def __init__(self, path=None):
+        self.path = path or config.ATTACHMENT_CACHE
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS attachments ("
+                "attachment_id TEXT PRIMARY KEY, content_hash TEXT, text TEXT)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS contents (content_hash TEXT PRIMARY KEY, text TEXT)")
+
+    def get_by_id(self, attachment_id):
+        """添付ファイルIDで取得（(見つかったか, テキスト)）"""
+        with closing(sqlite3.connect(self.path)) as conn:
+            row = conn.execute(
+                "SELECT text FROM attachments WHERE attachment_id = ?", (attachment_id,)
+            ).fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    def get_by_hash(self, content_hash):
+        """内容ハッシュで取得（同じファイルが別IDで再投稿された場合）"""
+        with closing(sqlite3.connect(self.path)) as conn:
+            row = conn.execute(
+                "SELECT text FROM contents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    def put(self, attachment_id, content_hash, text):
+        """抽出結果を保存（抽出できなかった場合も None として記録し再取得しない）"""
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO attachments (attachment_id, content_hash, text) VALUES (?, ?, ?)",
+                (attachment_id, content_hash, text)
+            )
+            if content_hash:
+                conn.execute(
+                    "INSERT OR REPLACE INTO contents (content_hash, text) VALUES (?, ?)", (content_hash, text)
+                )
+
+
+class AttachmentExtractor:
+    """添付ファイルをストリーミング取得し、テキストを抽出してメッセージに追加"""
+
+    def __init__(self, cache=None):
+        self.cache = cache or AttachmentCache()
+        self.pool = None
+        self.semaphore = asyncio.Semaphore(config.ATTACHMENT_CONCURRENCY)
+        # 依存パッケージの有無は起動時に1回だけ確認する
+        self.kinds = allowed_kinds()
+        self.stats = {'cached': 0, 'downloaded': 0, 'skipped': 0}
+
+    async def download(self, session, info):
+        """サイズ上限を守りながらストリーミングで取得（(バイト列, 内容ハッシュ)、上限超過時は None）"""
+        async with session.get(info['url']) as response:
+            if response.status != 200:
+                raise RuntimeError(f"添付ファイル取得失敗 {response.status}: {info['filename']}")
+            if (response.content_length or 0) > config.ATTACHMENT_MAX_BYTES:
+                return None, None
+
+            digest = hashlib.sha256()
+            buffer = bytearray()
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                buffer.extend(chunk)
+                if len(buffer) > config.ATTACHMENT_MAX_BYTES:
+                    return None, None
+                digest.update(chunk)
+        return bytes(buffer), digest.hexdigest()
+
+    async def extract(self, session, info):
+        """1つの添付ファイルのテキストを取得（キャッシュ済みならダウンロードしない）"""
+        kind = attachment_kind(info['filename'], info['content_type'], self.kinds)
+        if kind is None or info['size'] > config.ATTACHMENT_MAX_BYTES:
+            self.stats['skipped'] += 1
+            return None
+
+        found, text = self.cache.get_by_id(info['id'])
+        # pypdf がなかった頃に抽出できなかったPDFは、pypdf が使えるようになったら抽出し直す
+        if found and (text is not None or kind != 'pdf'):
+            self.stats['cached'] += 1
+            return text
+
+        async with self.semaphore:
+            data, content_hash = await self.download(session, info)
+        if data is None:
+            self.stats['skipped'] += 1
+            self.cache.put(info['id'], None, None)
+            return None
+
+        found, text = self.cache.get_by_hash(content_hash)
+        if not found or (text is None and kind == 'pdf'):
+            # 解析はCPUを使うため、イベントループを止めないようプロセスプールで実行
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=config.ATTACHMENT_WORKERS)
+            text = await asyncio.get_running_loop().run_in_executor(self.pool, extract_text, data, kind)
+            if text is None:
+                # 依存パッケージがないことによる失敗はキャッシュしない（インストール後に抽出できるように）
+                logger.warning("PDFの抽出には pypdf が必要です（pip install pypdf）")
+                return None
+            text = text.strip()[:config.ATTACHMENT_MAX_CHARS]
+        self.stats['downloaded'] += 1
+        self.cache.put(info['id'], content_hash, text)
+        return text
+
+    async def enrich(self, messages):
+        """メッセージの添付ファイルからテキストを抽出し attachment_texts に追加"""
+        targets = [
+            (msg, info) for msg in messages for info in msg.get('attachment_files', [])
+        ]
+        if not targets:
+            return messages
+
+        async with aiohttp.ClientSession() as session:
+            results = await asyncio.gather(
+                *(self.extract(session, info) for _, info in targets), return_exceptions=True
+            )
+
+        for (msg, info), result in zip(targets, results):
+            if isinstance(result, Exception):
+                logger.warning(f"添付ファイルの抽出に失敗: {info['filename']}: {result}")
+                continue
+            if result:
+                msg.setdefault('attachment_texts', []).append({'filename': info['filename'], 'text': result})
+        logger.info(
+            f"添付ファイル: キャッシュ {self.stats['cached']}件, 取得 {self.stats['downloaded']}件, "
+            f"対象外 {self.stats['skipped']}件"
+        )
+        return messages
+
+    def close(self):
+        """プロセスプールを終了"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
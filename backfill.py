@@ -0,0 +1,459 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import aiofiles
+import aiohttp
+import config
+from discord_rest import datetime_to_snowflake
+from model_router import ModelRouter, TEMPLATE_ROUTE, estimate_cost, format_messages
+from simple_scheduler import SimpleDiscordSummarizer
+from attachments import describe_attachment
+
+logger = logging.getLogger(__name__)
+
+# Batch APIは通常料金の半額
+BATCH_PRICE_RATIO = 0.5
+
+
+def parse_date(value):
+    """YYYY-MM-DD または ISO 8601 形式の日時をUTCとして解釈"""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+class LocalBatchClient:
+    """OpenAI Batch API のローカル代替（テスト・動作確認用）"""
+
+    def __init__(self, batch_dir):
+        self.batch_dir = batch_dir
+        os.makedirs(batch_dir, exist_ok=True)
+
+    def submit(self, requests_file):
+        """リクエストファイルをバッチとして登録"""
+        batch_id = f"local_{os.path.splitext(os.path.basename(requests_file))[0]}"
+        with open(requests_file, 'r', encoding='utf-8') as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+
+        results = []
+        for request in requests:
+            prompt = request['body']['messages'][-1]['content']
+            message_lines = [line for line in prompt.splitlines() if line.startswith('[')]
+            content = f"（ローカルバッチ）{len(message_lines)}件のメッセージ"
+            if message_lines:
+                content += f"\n{message_lines[0][:200]}"
+            results.append({
+                'custom_id': request['custom_id'],
+                'response': {
+                    'status_code': 200,
+                    'body': {
+                        'model': request['body']['model'],
+                        'choices': [{'message': {'role': 'assistant', 'content': content}}],
+                        'usage': {'prompt_tokens': 0, 'completion_tokens': 0},
+                    },
+                },
+                'error': None,
+            })
+
+        with open(os.path.join(self.batch_dir, f"{batch_id}_output.jsonl"), 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        return batch_id
+
+    def poll(self, batch_id):
+        """バッチの状態を取得"""
+        if os.path.isfile(os.path.join(self.batch_dir, f"{batch_id}_output.jsonl")):
+            return 'completed'
+        return 'failed'
+
+    def fetch_results(self, batch_id):
+        """バッチ結果を取得"""
+        with open(os.path.join(self.batch_dir, f"{batch_id}_output.jsonl"), 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class OpenAIBatchClient:
+    """OpenAI Batch API クライアント"""
+
+    def __init__(self):
+        import openai
+        if not hasattr(openai, 'OpenAI'):
+            # Batch API は openai SDK 1.x 以降のみ
+            raise RuntimeError(
+                f"Batch API には openai 1.x 以降が必要です（インストール済み: {openai.__version__}）。"
+                "pip install -r requirements.txt で更新するか、--local を指定してください"
+            )
+        self.client = openai.OpenAI(api_key=config.OPENAI_API_KEY)
+
+    def submit(self, requests_file):
+        """リクエストファイルをアップロードしてバッチを作成"""
+        with open(requests_file, 'rb') as f:
+            batch_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h'
+        )
+        return batch.id
+
+    def poll(self, batch_id):
+        """バッチの状態を取得"""
+        return self.client.batches.retrieve(batch_id).status
+
+    def fetch_results(self, batch_id):
+        """バッチ結果を取得"""
+        batch = self.client.batches.retrieve(batch_id)
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.client.files.content(file_id).text
+            results.extend(json.loads(line) for line in content.splitlines() if line.strip())
+        return results
+
+
+class BackfillRunner:
+    """過去期間を要約ウィンドウに分割し、バッチで一括要約する（再開可能）"""
+
+    def __init__(self, start, end, window_hours, batch_client, poll_interval=60):
+        self.start = start
+        self.end = end
+        self.window = timedelta(hours=window_hours)
+        self.batch_client = batch_client
+        self.poll_interval = poll_interval
+        self.discord = SimpleDiscordSummarizer()
+        self.model_router = ModelRouter()
+        self.failed_channels = []
+
+        backfill_dir = os.getenv('BACKFILL_DIR', 'backfill')
+        os.makedirs(backfill_dir, exist_ok=True)
+        range_key = f"{start.strftime('%Y%m%d%H%M')}_{end.strftime('%Y%m%d%H%M')}_{window_hours}h"
+        self.state_file = os.path.join(backfill_dir, f"backfill_{range_key}.json")
+        self.requests_file = os.path.join(backfill_dir, f"backfill_{range_key}_requests.jsonl")
+        self.state = {'channels': {}, 'windows': {}, 'batches': []}
+
+    async def load_state(self):
+        """前回の進捗を読み込み"""
+        if os.path.isfile(self.state_file):
+            async with aiofiles.open(self.state_file, 'r', encoding='utf-8') as f:
+                self.state = json.loads(await f.read())
+            logger.info(f"バックフィルの進捗を再開: {self.state_file}")
+
+    async def save_state(self):
+        """進捗を保存（一時ファイル経由で置き換え）"""
+        tmp_file = self.state_file + '.tmp'
+        async with aiofiles.open(tmp_file, 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(self.state, ensure_ascii=False, indent=2))
+        os.replace(tmp_file, self.state_file)
+
+    async def fetch_range(self, session, channel_id):
+        """期間内のメッセージをページングしながら全件取得"""
+        messages = []
+        after = datetime_to_snowflake(self.start)
+        url = f"https://discord.com/api/v10/channels/{channel_id}/messages"
+
+        while True:
+            async with session.get(url, headers=self.discord.headers, params={'limit': 100, 'after': after}) as response:
+                if response.status == 429:
+                    retry_after = (await response.json()).get('retry_after', 1)
+                    await asyncio.sleep(retry_after)
+                    continue
+                if response.status != 200:
+                    # 途中までのメッセージで取得済みにすると、欠けたウィンドウを再実行で取り戻せない
+                    raise RuntimeError(f"メッセージ取得失敗 (チャンネル: {channel_id}): {response.status}")
+                message_data = await response.json()
+
+            if not message_data:
+                break
+
+            after = max(int(msg['id']) for msg in message_data)
+            reached_end = False
+            for msg in message_data:
+                msg_time = datetime.fromisoformat(msg['timestamp'].replace('Z', '+00:00'))
+                if msg_time >= self.end:
+                    reached_end = True
+                    continue
+                if msg.get('author', {}).get('bot', False):
+                    continue
+                messages.append({
+                    'author': msg['author']['username'],
+                    'content': msg['content'],
+                    'timestamp': msg['timestamp'],
+                    'attachments': [att['url'] for att in msg.get('attachments', [])],
+                    'attachment_files': [describe_attachment(att) for att in msg.get('attachments', [])],
+                })
+
+            if reached_end or len(message_data) < 100:
+                break
+
+        return sorted(messages, key=lambda x: x['timestamp'])
+
+    def split_windows(self, messages):
+        """メッセージを要約ウィンドウごとに分割"""
+        windows = {}
+        for msg in messages:
+            msg_time = datetime.fromisoformat(msg['timestamp'].replace('Z', '+00:00'))
+            index = int((msg_time - self.start) / self.window)
+            windows.setdefault(index, []).append(msg)
+        return windows
+
+    async def collect(self, session):
+        """全チャンネルのメッセージを取得し、バッチリクエストを作成"""
+        channel_ids = await self.discord.resolve_channel_ids(session)
+
+        for channel_id in channel_ids:
+            if self.state['channels'].get(str(channel_id), {}).get('collected'):
+                continue
+
+            channel_name = await self.discord.fetch_channel_info(session, channel_id)
+            logger.info(f"チャンネル {channel_name} の過去メッセージを取得")
+            try:
+                messages = await self.fetch_range(session, channel_id)
+            except Exception as e:
+                # 取得済みにしないため、再実行時にこのチャンネルを最初から取得し直す
+                logger.error(f"チャンネル {channel_name} の取得に失敗（再実行で再取得します）: {e}")
+                self.failed_channels.append(channel_name)
+                continue
+            if self.discord.attachment_extractor:
+                await self.discord.attachment_extractor.enrich(messages)
+
+            request_lines = []
+            for index, window_messages in sorted(self.split_windows(messages).items()):
+                window_start = self.start + self.window * index
+                window_end = min(window_start + self.window, self.end)
+                window_messages = window_messages[:config.MAX_MESSAGES_PER_CHANNEL]
+                custom_id = f"{channel_id}-{window_start.strftime('%Y%m%dT%H%M')}"
+
+                prompt = config.SUMMARY_PROMPT.format(
+                    channel_name=channel_name,
+                    start_time=window_start.strftime("%Y-%m-%d %H:%M:%S"),
+                    end_time=window_end.strftime("%Y-%m-%d %H:%M:%S"),
+                    messages=format_messages(window_messages)
+                )
+                route = self.model_router.route(channel_name, window_messages, prompt, channel_id, incremental=False)
+
+                window_state = {
+                    'channel_id': channel_id,
+                    'channel_name': channel_name,
+                    'period_start': window_start.isoformat(),
+                    'period_end': window_end.isoformat(),
+                    'messages_count': len(window_messages),
+                    'route': route['name'],
+                    'model': route['model'],
+                    'status': 'pending',
+                }
+                self.state['windows'][custom_id] = window_state
+
+                if route['name'] == TEMPLATE_ROUTE:
+                    # 小さなウィンドウはバッチに入れずその場で要約
+                    summary = self.model_router.template_summary(channel_name, window_messages)
+                    await self.save_window_summary(custom_id, summary)
+                    continue
+
+                request_lines.append(json.dumps({
+                    'custom_id': custom_id,
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': self.model_router.completion_params(route, prompt),
+                }, ensure_ascii=False))
+
+            if request_lines:
+                async with aiofiles.open(self.requests_file, 'a', encoding='utf-8') as f:
+                    await f.write("\n".join(request_lines) + "\n")
+
+            self.state['channels'][str(channel_id)] = {'name': channel_name, 'collected': True}
+            await self.save_state()
+
+    async def save_window_summary(self, custom_id, summary):
+        """ウィンドウの要約をアーカイブに保存"""
+        window_state = self.state['windows'][custom_id]
+        summary_dir = os.getenv('SUMMARY_DIR', 'summaries')
+        os.makedirs(summary_dir, exist_ok=True)
+
+        period_end = datetime.fromisoformat(window_state['period_end'])
+        timestamp = period_end.strftime("%Y%m%d_%H%M%S")
+        summary_data = {
+            "channel_name": window_state['channel_name'],
+            "summary_timestamp": timestamp,
+            "period_start": window_state['period_start'],
+            "period_end": window_state['period_end'],
+            "messages_count": window_state['messages_count'],
+            "summary": summary,
+            "source": "backfill"
+        }
+
+        filename = os.path.join(summary_dir, f"{window_state['channel_name']}_{timestamp}.json")
+        async with aiofiles.open(filename, 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(summary_data, ensure_ascii=False, indent=2))
+
+        window_state['status'] = 'done'
+        window_state['filename'] = filename
+
+    async def write_pending_requests(self):
+        """未完了ウィンドウのリクエストのみを投入用ファイルに書き出し"""
+        pending = {cid for cid, w in self.state['windows'].items() if w['status'] == 'pending'}
+        if not pending or not os.path.isfile(self.requests_file):
+            return None, 0
+
+        submit_file = self.requests_file.replace('_requests.jsonl', f"_submit_{len(self.state['batches'])}.jsonl")
+        async with aiofiles.open(self.requests_file, 'r', encoding='utf-8') as src:
+            lines = (await src.read()).splitlines()
+
+        # 取得途中で中断したチャンネルは再取得されるため、同じウィンドウは最後の行を採用
+        requests = {}
+        for line in lines:
+            if line.strip():
+                custom_id = json.loads(line)['custom_id']
+                if custom_id in pending:
+                    requests[custom_id] = line
+
+        async with aiofiles.open(submit_file, 'w', encoding='utf-8') as dst:
+            for line in requests.values():
+                await dst.write(line + "\n")
+        return submit_file, len(requests)
+
+    async def apply_results(self, results):
+        """バッチ結果を要約アーカイブに書き込み"""
+        prompt_tokens = completion_tokens = 0
+        cost = 0.0
+        for result in results:
+            window_state = self.state['windows'].get(result['custom_id'])
+            if not window_state or window_state['status'] == 'done':
+                continue
+
+            response = result.get('response') or {}
+            if result.get('error') or response.get('status_code') != 200:
+                logger.error(f"バッチ要約失敗: {result['custom_id']}: {result.get('error') or response.get('status_code')}")
+                continue
+
+            body = response['body']
+            usage = body.get('usage') or {}
+            prompt_tokens += usage.get('prompt_tokens', 0)
+            completion_tokens += usage.get('completion_tokens', 0)
+            cost += estimate_cost(
+                window_state['model'], usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+            ) * BATCH_PRICE_RATIO
+            await self.save_window_summary(result['custom_id'], body['choices'][0]['message']['content'])
+
+        await self.save_state()
+        return prompt_tokens, completion_tokens, cost
+
+    async def wait_for_batch(self, batch):
+        """バッチの完了をポーリング"""
+        while True:
+            status = self.batch_client.poll(batch['id'])
+            batch['status'] = status
+            await self.save_state()
+            if status in ('completed', 'failed', 'expired', 'cancelled'):
+                return status
+            logger.info(f"バッチ {batch['id']} 実行中 ({status})")
+            await asyncio.sleep(self.poll_interval)
+
+    async def run(self):
+        """バックフィルを実行（中断後の再実行で続きから再開）"""
+        started = time.monotonic()
+        await self.load_state()
+
+        async with aiohttp.ClientSession() as session:
+            await self.collect(session)
+
+        # 投入済みで未回収のバッチがあれば先に回収
+        for batch in self.state['batches']:
+            if batch.get('applied'):
+                continue
+            await self.finish_batch(batch)
+
+        submit_file, count = await self.write_pending_requests()
+        if count:
+            batch_id = self.batch_client.submit(submit_file)
+            logger.info(f"バッチを投入: {batch_id} ({count}件)")
+            batch = {'id': batch_id, 'status': 'submitted', 'requests': count}
+            self.state['batches'].append(batch)
+            await self.save_state()
+            await self.finish_batch(batch)
+
+        windows = self.state['windows'].values()
+        done = sum(1 for w in windows if w['status'] == 'done')
+        pending = sum(1 for w in windows if w['status'] == 'pending')
+        report = {
+            'windows_done': done,
+            'windows_pending': pending,
+            'channels_failed': self.failed_channels,
+            'batches': len(self.state['batches']),
+            'prompt_tokens': sum(b.get('prompt_tokens', 0) for b in self.state['batches']),
+            'completion_tokens': sum(b.get('completion_tokens', 0) for b in self.state['batches']),
+            'cost': sum(b.get('cost', 0.0) for b in self.state['batches']),
+            'elapsed': time.monotonic() - started,
+        }
+        logger.info(f"バックフィル完了: {report}")
+        return report
+
+    async def finish_batch(self, batch):
+        """バッチの完了を待って結果を反映"""
+        status = await self.wait_for_batch(batch)
+        if status != 'completed':
+            logger.error(f"バッチ {batch['id']} が完了しませんでした: {status}")
+            batch['applied'] = True
+            await self.save_state()
+            return
+
+        results = self.batch_client.fetch_results(batch['id'])
+        prompt_tokens, completion_tokens, cost = await self.apply_results(results)
+        batch.update({
+            'applied': True,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost': cost,
+        })
+        await self.save_state()
+
+
+async def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description="過去期間の要約をバッチで一括生成")
+    parser.add_argument('--start', required=True, help="開始日時（例: 2026-09-01）")
+    parser.add_argument('--end', required=True, help="終了日時（例: 2026-10-01）")
+    parser.add_argument('--window-hours', type=int, default=config.SUMMARY_INTERVAL_HOURS, help="要約ウィンドウの長さ（時間）")
+    parser.add_argument('--poll-interval', type=int, default=60, help="バッチ状態の確認間隔（秒）")
+    parser.add_argument('--local', action='store_true', help="OpenAIの代わりにローカルのバッチ代替を使用")
+    args = parser.parse_args()
+
+    if not config.DISCORD_BOT_TOKEN:
+        logger.error("DISCORD_BOT_TOKEN が設定されていません")
+        exit(1)
+
+    if not args.local and not config.OPENAI_API_KEY:
+        logger.error("OPENAI_API_KEY が設定されていません")
+        exit(1)
+
+    if args.local:
+        batch_client = LocalBatchClient(os.path.join(os.getenv('BACKFILL_DIR', 'backfill'), 'local_batches'))
+    else:
+        try:
+            batch_client = OpenAIBatchClient()
+        except RuntimeError as e:
+            logger.error(str(e))
+            exit(1)
+
+    runner = BackfillRunner(
+        parse_date(args.start), parse_date(args.end), args.window_hours, batch_client, args.poll_interval
+    )
+    report = await runner.run()
+
+    print(f"\n🎉 バックフィル完了: {report['windows_done']}件の要約（未完了 {report['windows_pending']}件）")
+    print(f"🧾 バッチ {report['batches']}件, トークン {report['prompt_tokens']}+{report['completion_tokens']}, ${report['cost']:.4f}")
+    print(f"⏱️ 所要時間 {report['elapsed']:.1f}s")
+    if report['channels_failed']:
+        print(f"⚠️ 取得に失敗したチャンネル: {', '.join(report['channels_failed'])}")
+    if report['windows_pending'] or report['channels_failed']:
+        print("💡 同じ引数で再実行すると未完了のウィンドウ・チャンネルから再開します")
+
+    return report
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# 新しいPythonプロセスでBotのキャッシュに合成したGateway イベントを流し込み、定常状態のRSSを計測する
+# （サーバー参加時のGUILD_CREATEと、要約間隔のあいだに受信するMESSAGE_CREATEを再現。ネットワーク接続は不要）
+MEASURE_SNIPPET = """
+import asyncio, gc, json, os, resource
+import bot_profile
+from discord.ext import commands
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def user(i):
+    return {{'id': str(10_000_000 + i), 'username': f'user{{i}}', 'global_name': f'ユーザー{{i}}', 'discriminator': '0', 'avatar': None}}
+
+def member(i):
+    return {{'user': user(i), 'roles': [], 'joined_at': '2024-01-01T00:00:00+00:00', 'deaf': False, 'mute': False, 'nick': None, 'flags': 0}}
+
+async def main():
+    bot = commands.Bot(command_prefix='!', **bot_profile.bot_options(low_memory={low_memory}))
+    # ログインせずにイベントを処理できるよう、イベントループだけを設定する
+    await bot._async_setup_hook()
+    state = bot._connection
+
+    members = {members}
+    channels = max(10, members // 500)
+    voice_members = members // 20
+    guild_id = '900000000000000000'
+    guild = {{
+        'id': guild_id, 'name': 'bench', 'member_count': members, 'large': members > 250, 'features': [],
+        'roles': [{{'id': str(800_000 + i), 'name': f'role{{i}}', 'permissions': '0', 'position': i, 'color': 0,
+                    'hoist': False, 'managed': False, 'mentionable': False}} for i in range(max(1, members // 200))],
+        'emojis': [{{'id': str(700_000 + i), 'name': f'emoji{{i}}', 'roles': [], 'require_colons': True,
+                     'managed': False, 'animated': False, 'available': True}} for i in range(min(250, members // 100))],
+        'stickers': [],
+        'channels': [{{'id': str(600_000 + i), 'type': 0, 'name': f'ch{{i}}', 'position': i, 'permission_overwrites': []}}
+                     for i in range(channels)] + [{{'id': '500000', 'type': 2, 'name': 'voice', 'position': 0,
+                                                    'permission_overwrites': [], 'bitrate': 64000, 'user_limit': 0}}],
+        # ボイスチャンネルの参加者は members / voice_states としてGUILD_CREATEに含まれる
+        'members': [member(i) for i in range(voice_members)],
+        'voice_states': [{{'user_id': str(10_000_000 + i), 'channel_id': '500000', 'session_id': 'x', 'deaf': False,
+                           'mute': False, 'self_deaf': False, 'self_mute': False, 'self_video': False,
+                           'suppress': False, 'request_to_speak_timestamp': None}} for i in range(voice_members)],
+        'threads': [], 'stage_instances': [], 'guild_scheduled_events': [], 'presences': [],
+    }}
+    content = 'サーバーのメンテナンスについての連絡です。' * 5
+    events = [{{
+        'id': str(1_000_000_000 + i), 'channel_id': str(600_000 + i % channels), 'guild_id': guild_id,
+        'author': user(i % members), 'member': {{k: v for k, v in member(i % members).items() if k != 'user'}},
+        'content': content, 'timestamp': '2026-01-01T00:00:00+00:00', 'edited_timestamp': None, 'tts': False,
+        'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [],
+        'pinned': False, 'type': 0,
+    }} for i in range({messages})]
+
+    # イベントを作り終えてから計測を始め、キャッシュに残った分だけを差分にする
+    gc.collect()
+    baseline = rss_mb()
+    state.parse_guild_create(guild)
+    for i, event in enumerate(events):
+        state.parse_message_create(event)
+        # 実際の受信と同じように、on_message（コマンド処理）を都度実行させる
+        if i % 50 == 0:
+            await asyncio.sleep(0)
+    await asyncio.sleep(0.1)
+    gc.collect()
+
+    cached = bot.get_guild(int(guild_id))
+    print(json.dumps({{
+        'baseline': baseline, 'steady': rss_mb(), 'members': len(cached.members),
+        'messages': len(bot.cached_messages),
+    }}))
+
+asyncio.run(main())
+"""
+
+
+def measure(low_memory, members, messages):
+    """1つの設定・サーバー規模の定常RSSを別プロセスで計測（他の計測のメモリが残らないように）"""
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE_SNIPPET.format(low_memory=low_memory, members=members, messages=messages)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description="常時稼働Botの定常RSSをサーバー規模ごとに計測（標準 / 省メモリ）")
+    parser.add_argument('--sizes', default="1000,10000,100000", help="サーバーのメンバー数（カンマ区切り）")
+    parser.add_argument('--messages', type=int, default=5000, help="要約間隔のあいだに受信するメッセージ数")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    print("定常RSSベンチマーク（MB、差分はイベント受信前からの増加量）")
+    print(f"  {'メンバー数':>10s} {'設定':8s} {'受信前':>8s} {'定常':>8s} {'差分':>8s} {'キャッシュ(メンバー/メッセージ)':>s}")
+    for members in sizes:
+        for label, low_memory in (('standard', False), ('low', True)):
+            result = measure(low_memory, members, args.messages)
+            print(
+                f"  {members:>10d} {label:8s} {result['baseline']:8.1f} {result['steady']:8.1f} "
+                f"{result['steady'] - result['baseline']:8.1f} {result['members']}/{result['messages']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
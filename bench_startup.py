@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+# 新しいPythonプロセスで scheduler の import と DiscordScheduler の生成にかかる時間を計測する
+IMPORT_SNIPPET = """
+import json, time
+started = time.perf_counter()
+import scheduler
+scheduler.DiscordScheduler(rest_only={rest_only})
+print(json.dumps({{'import': time.perf_counter() - started, 'modules': len(__import__('sys').modules)}}))
+"""
+
+
+def measure_import(rest_only):
+    """importと初期化の時間を別プロセスで計測（モジュールキャッシュの影響を受けないように）"""
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(rest_only=rest_only)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+async def measure_network(rest_only):
+    """ログインと最初の取得（チャンネル情報のプリフェッチ＋最初のメッセージ取得）の時間を計測"""
+    import config
+    import scheduler
+    from datetime import datetime, timedelta
+
+    runner = scheduler.DiscordScheduler(rest_only=rest_only)
+    try:
+        await runner.login()
+        started = time.monotonic()
+        channels = await runner.prefetch_channels()
+        if channels:
+            channel = next(iter(channels.values()))
+            since_time = datetime.utcnow() - timedelta(hours=config.SUMMARY_INTERVAL_HOURS)
+            await runner.fetch_messages_since(channel, since_time)
+        first_fetch = time.monotonic() - started
+        return {'login': runner.timings['login'], 'first_fetch': first_fetch, 'channels': len(channels)}
+    finally:
+        await runner.client.close()
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description="間欠実行の起動時間を計測（import / ログイン / 最初の取得）")
+    parser.add_argument('--budget-ms', type=float, default=3000, help="REST版の合計時間の上限（ミリ秒）")
+    parser.add_argument('--repeat', type=int, default=3, help="import計測の繰り返し回数（最小値を採用）")
+    parser.add_argument('--skip-network', action='store_true', help="ログインと取得の計測を省略")
+    args = parser.parse_args()
+
+    results = {}
+    for label, rest_only in (('rest', True), ('gateway', False)):
+        samples = [measure_import(rest_only) for _ in range(args.repeat)]
+        results[label] = min(samples, key=lambda sample: sample['import'])
+
+    network = not args.skip_network and os.getenv('DISCORD_BOT_TOKEN')
+    if network:
+        for label, rest_only in (('rest', True), ('gateway', False)):
+            results[label].update(asyncio.run(measure_network(rest_only)))
+
+    print("起動時間ベンチマーク")
+    for label, result in results.items():
+        line = f"  {label:8s} import {result['import'] * 1000:7.1f}ms ({result['modules']} modules)"
+        if network:
+            line += (
+                f", login {result['login'] * 1000:7.1f}ms"
+                f", first fetch {result['first_fetch'] * 1000:7.1f}ms ({result['channels']} channels)"
+            )
+        print(line)
+    if not network:
+        print("  ※ DISCORD_BOT_TOKEN 未設定または --skip-network のため、ログインと取得は計測していません")
+
+    rest = results['rest']
+    total_ms = (rest['import'] + rest.get('login', 0) + rest.get('first_fetch', 0)) * 1000
+    print(f"REST版合計: {total_ms:.1f}ms / 上限 {args.budget_ms:.0f}ms")
+    if total_ms > args.budget_ms:
+        print("❌ 起動時間が上限を超えました")
+        sys.exit(1)
+    print("✅ 上限内です")
+
+if __name__ == "__main__":
+    main()
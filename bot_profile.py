@@ -0,0 +1,37 @@
+import discord
+import config
+
+
+def bot_intents(low_memory=None):
+    """Botに必要なIntentsを作成（省メモリ時は監視・コマンドに必要なものだけ）"""
+    if low_memory is None:
+        low_memory = config.BOT_LOW_MEMORY
+
+    if not low_memory:
+        intents = discord.Intents.default()
+        intents.message_content = True
+        return intents
+
+    # guilds: サーバー・チャンネル情報（get_guild / get_channel）
+    # guild_messages / dm_messages / message_content: コマンドの受信とメッセージ本文
+    # メンバー・プレゼンス・リアクション・入力中・ボイス等のイベントは受け取らない
+    return discord.Intents(
+        guilds=True,
+        guild_messages=True,
+        dm_messages=True,
+        message_content=True,
+    )
+
+
+def bot_options(low_memory=None):
+    """commands.Bot / discord.Client に渡すキャッシュ設定"""
+    if low_memory is None:
+        low_memory = config.BOT_LOW_MEMORY
+
+    options = {'intents': bot_intents(low_memory)}
+    if low_memory:
+        # 要約はREST（history）で取得するため、受信メッセージとメンバーはキャッシュしない
+        options['member_cache_flags'] = discord.MemberCacheFlags.none()
+        options['max_messages'] = config.BOT_MAX_MESSAGES or None
+        options['chunk_guilds_at_startup'] = False
+    return options
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -65,3 +66,160 @@ SUMMARY_PROMPT = """
 
 要約:
 """
+
+# モデルルーティング設定
+# 小さな期間は安価なモデルやテンプレート要約、大きく重要なチャンネルは長文脈モデルへ振り分ける
+def parse_channel_priorities():
+    """チャンネルごとの優先度（例: general:high,lecture:low）を処理"""
+    priorities = {}
+    raw_priorities = os.getenv('CHANNEL_PRIORITIES', '').split(',')
+    
+    for item in raw_priorities:
+        item = item.strip()
+        if not item or ':' not in item:
+            continue
+        
+        channel, priority = item.rsplit(':', 1)
+        channel = channel.strip()
+        priorities[int(channel) if channel.isdigit() else channel] = priority.strip().lower()
+    
+    return priorities
+
+CHANNEL_PRIORITIES = parse_channel_priorities()
+ROUTER_TEMPLATE_MAX_MESSAGES = int(os.getenv('ROUTER_TEMPLATE_MAX_MESSAGES', 3))
+ROUTER_SMALL_MAX_TOKENS = int(os.getenv('ROUTER_SMALL_MAX_TOKENS', 1500))
+ROUTER_LARGE_MIN_TOKENS = int(os.getenv('ROUTER_LARGE_MIN_TOKENS', 12000))
+ROUTER_SMALL_MODEL = os.getenv('ROUTER_SMALL_MODEL', 'gpt-4o-mini')
+ROUTER_DEFAULT_MODEL = os.getenv('ROUTER_DEFAULT_MODEL', 'gpt-3.5-turbo')
+ROUTER_LARGE_MODEL = os.getenv('ROUTER_LARGE_MODEL', 'gpt-4o')
+ROUTER_LARGE_REASONING_EFFORT = os.getenv('ROUTER_LARGE_REASONING_EFFORT', '')
+ROUTER_REASONING_MODEL_PREFIXES = tuple(
+    prefix.strip() for prefix in os.getenv('ROUTER_REASONING_MODEL_PREFIXES', 'o1,o3,o4').split(',') if prefix.strip()
+)
+
+# 複数サーバー設定
+def parse_guilds():
+    """複数サーバーの設定（GUILDS_FILE のJSON）を処理、未指定時は GUILD_ID / CHANNEL_IDS を使用"""
+    guilds_file = os.getenv('GUILDS_FILE', '').strip()
+    if guilds_file:
+        with open(guilds_file, 'r', encoding='utf-8') as f:
+            raw_guilds = json.load(f)
+        
+        guilds = []
+        for guild in raw_guilds:
+            channels = [
+                int(channel) if str(channel).isdigit() else str(channel)
+                for channel in guild.get('channels', [])
+            ]
+            guilds.append({
+                'guild_id': int(guild['guild_id']),
+                'channels': channels,
+                'webhook_url': guild.get('webhook_url', ''),
+            })
+        return guilds
+    
+    if CHANNEL_IDS:
+        return [{
+            'guild_id': GUILD_ID,
+            'channels': CHANNEL_IDS,
+            'webhook_url': os.getenv('DISCORD_WEBHOOK_URL', ''),
+        }]
+    return []
+
+GUILDS = parse_guilds()
+
+# シャーディング設定（複数ワーカーで共有するストアとリース期間）
+SHARD_STORE = os.getenv('SHARD_STORE', 'shard_store.sqlite3')
+SHARD_LEASE_SECONDS = int(os.getenv('SHARD_LEASE_SECONDS', 300))
+SHARD_HEARTBEAT_SECONDS = int(os.getenv('SHARD_HEARTBEAT_SECONDS', 30))
+
+# ジョブキュー設定（収集・要約・配信の各ステージ）
+QUEUE_PATH = os.getenv('QUEUE_PATH', 'job_queue.sqlite3')
+QUEUE_COLLECT_WORKERS = int(os.getenv('QUEUE_COLLECT_WORKERS', 2))
+QUEUE_SUMMARIZE_WORKERS = int(os.getenv('QUEUE_SUMMARIZE_WORKERS', 2))
+QUEUE_DELIVER_WORKERS = int(os.getenv('QUEUE_DELIVER_WORKERS', 2))
+QUEUE_MAX_ATTEMPTS = int(os.getenv('QUEUE_MAX_ATTEMPTS', 10))
+QUEUE_ATTEMPTS_PER_RUN = int(os.getenv('QUEUE_ATTEMPTS_PER_RUN', 2))
+QUEUE_BACKOFF_SECONDS = int(os.getenv('QUEUE_BACKOFF_SECONDS', 5))
+QUEUE_MAX_WAIT_SECONDS = int(os.getenv('QUEUE_MAX_WAIT_SECONDS', 60))
+
+# 差分要約設定（前回の要約＋新着メッセージのみを送信）
+INCREMENTAL_SUMMARY = os.getenv('INCREMENTAL_SUMMARY', 'false').strip().lower() in ('1', 'true', 'yes')
+RUNNING_SUMMARY_MAX_CHARS = int(os.getenv('RUNNING_SUMMARY_MAX_CHARS', 1500))
+DELTA_SUMMARY_PROMPT = """
+以下はDiscordチャンネルのこれまでの要約と、その後に投稿された新しいメッセージです。
+背景の説明を繰り返さず、新しいメッセージの内容だけを取り込んで要約を更新してください。
+
+チャンネル名: {channel_name}
+期間: {start_time} から {end_time} まで
+
+これまでの要約:
+{previous_summary}
+
+新しいメッセージ:
+{messages}
+
+次の形式で出力してください。
+## 新着
+（この期間の新しい動き・決定事項を3〜5行で）
+## 最新の要約
+（これまでの要約に新着を反映した全体の要約、{max_chars}文字以内）
+"""
+
+# 間欠実行の起動設定（true: Gateway/discord.py を使わずREST APIのみで実行）
+SCHEDULER_REST_ONLY = os.getenv('SCHEDULER_REST_ONLY', 'false').strip().lower() in ('1', 'true', 'yes')
+
+# LLMのレート制限設定（0は無制限）とチャンネルごとの重み（例: general:3,lecture:1）
+LLM_TPM_LIMIT = int(os.getenv('LLM_TPM_LIMIT', 0))
+LLM_RPM_LIMIT = int(os.getenv('LLM_RPM_LIMIT', 0))
+LLM_DEADLINE_SECONDS = int(os.getenv('LLM_DEADLINE_SECONDS', 600))
+
+def parse_channel_weights():
+    """チャンネルごとの重みを処理"""
+    weights = {}
+    for item in os.getenv('CHANNEL_WEIGHTS', '').split(','):
+        item = item.strip()
+        if not item or ':' not in item:
+            continue
+        
+        channel, weight = item.rsplit(':', 1)
+        channel = channel.strip()
+        weights[int(channel) if channel.isdigit() else channel] = float(weight)
+    
+    return weights
+
+CHANNEL_WEIGHTS = parse_channel_weights()
+
+# LLMエンドポイント設定（LLM_ENDPOINTS にJSONで複数指定可能）
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv('LLM_REQUEST_TIMEOUT_SECONDS', 120))
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 10))
+LLM_HEDGE_INITIAL_DELAY_SECONDS = float(os.getenv('LLM_HEDGE_INITIAL_DELAY_SECONDS', 30))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 3))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv('LLM_BREAKER_COOLDOWN_SECONDS', 60))
+
+# チャンネル横断のトピック集約（同じ話題を1回だけ要約し、各チャンネル要約から参照）
+TOPIC_CLUSTERING = os.getenv('TOPIC_CLUSTERING', 'false').strip().lower() in ('1', 'true', 'yes')
+TOPIC_EMBEDDER = os.getenv('TOPIC_EMBEDDER', 'local').strip().lower()  # local または openai
+TOPIC_EMBEDDING_MODEL = os.getenv('TOPIC_EMBEDDING_MODEL', 'text-embedding-3-small')
+TOPIC_SIMILARITY_THRESHOLD = float(os.getenv('TOPIC_SIMILARITY_THRESHOLD', 0.8))
+TOPIC_MIN_CHARS = int(os.getenv('TOPIC_MIN_CHARS', 20))
+TOPIC_MIN_MESSAGES = int(os.getenv('TOPIC_MIN_MESSAGES', 2))
+EMBEDDING_CACHE = os.getenv('EMBEDDING_CACHE', 'embedding_cache.sqlite3')
+
+# 添付ファイルのテキスト抽出（ログ・テキスト・PDFなどを要約に含める）
+ATTACHMENT_EXTRACTION = os.getenv('ATTACHMENT_EXTRACTION', 'false').strip().lower() in ('1', 'true', 'yes')
+ATTACHMENT_TYPES = os.getenv('ATTACHMENT_TYPES', 'text,pdf')  # text / pdf（PDFは pypdf が必要）
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_BYTES', 2 * 1024 * 1024))
+ATTACHMENT_MAX_CHARS = int(os.getenv('ATTACHMENT_MAX_CHARS', 4000))
+ATTACHMENT_WORKERS = int(os.getenv('ATTACHMENT_WORKERS', 2))
+ATTACHMENT_CONCURRENCY = int(os.getenv('ATTACHMENT_CONCURRENCY', 4))
+ATTACHMENT_CACHE = os.getenv('ATTACHMENT_CACHE', 'attachment_cache.sqlite3')
+
+# 実行中に再読み込みする設定ファイル（JSON、常時稼働版のみ。未指定時は監視しない）
+RUNTIME_CONFIG_FILE = os.getenv('RUNTIME_CONFIG_FILE', '').strip()
+RUNTIME_CONFIG_POLL_SECONDS = float(os.getenv('RUNTIME_CONFIG_POLL_SECONDS', 30))
+
+# 常時稼働Botの省メモリ設定（Intentsの絞り込み、メンバー・メッセージキャッシュの無効化、起動時のメンバー取得の省略）
+BOT_LOW_MEMORY = os.getenv('BOT_LOW_MEMORY', 'false').strip().lower() in ('1', 'true', 'yes')
+BOT_MAX_MESSAGES = int(os.getenv('BOT_MAX_MESSAGES', 0))  # 省メモリ時に保持する受信メッセージ数（0はキャッシュしない）
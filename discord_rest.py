@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+API_BASE = "https://discord.com/api/v10"
+DISCORD_EPOCH_MS = 1420070400000
+
+
+def datetime_to_snowflake(dt):
+    """日時をDiscordのSnowflake IDに変換（after/before指定用、naiveな日時はUTCとして扱う）"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (int(dt.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22
+
+
+class RestAuthor:
+    """REST APIのメッセージ作成者（discord.py の Member 互換の最小属性）"""
+
+    def __init__(self, data):
+        self.bot = data.get('bot', False)
+        self.display_name = data.get('global_name') or data.get('username', '')
+
+
+class RestAttachment:
+    """REST APIの添付ファイル（discord.py の Attachment 互換の最小属性）"""
+
+    def __init__(self, data):
+        self.id = int(data['id'])
+        self.url = data['url']
+        self.filename = data.get('filename', '')
+        self.size = data.get('size', 0)
+        self.content_type = data.get('content_type', '')
+
+
+class RestMessage:
+    """REST APIのメッセージ（discord.py の Message 互換の最小属性）"""
+
+    def __init__(self, data):
+        self.id = int(data['id'])
+        self.author = RestAuthor(data.get('author', {}))
+        self.content = data.get('content', '')
+        self.created_at = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
+        self.attachments = [RestAttachment(att) for att in data.get('attachments', [])]
+
+
+class RestChannel:
+    """REST APIのチャンネル（discord.py の TextChannel 互換の最小属性）"""
+
+    def __init__(self, client, data):
+        self.client = client
+        self.id = int(data['id'])
+        self.name = data.get('name', f"Channel-{data['id']}")
+        self.guild_id = int(data['guild_id']) if data.get('guild_id') else None
+
+    async def history(self, limit=100, after=None, before=None):
+        """指定期間のメッセージを古い順に取得（discord.py の history(after=..., before=...) と同じ順序）"""
+        after_id = datetime_to_snowflake(after) if after else 0
+        before_id = datetime_to_snowflake(before) if before else None
+        fetched = 0
+        while fetched < limit:
+            page = await self.client.request(
+                'GET', f"/channels/{self.id}/messages",
+                params={'limit': min(100, limit - fetched), 'after': after_id}
+            )
+            if not page:
+                return
+            page.sort(key=lambda msg: int(msg['id']))
+            for data in page:
+                # before 以降のメッセージは次回の取得範囲なので、ここで打ち切る
+                if before_id is not None and int(data['id']) >= before_id:
+                    return
+                yield RestMessage(data)
+            fetched += len(page)
+            after_id = int(page[-1]['id'])
+            if len(page) < 100:
+                return
+
+
+class DiscordRestClient:
+    """Gateway接続なしでREST APIのみを使う軽量クライアント（間欠実行の起動高速化用）"""
+
+    def __init__(self, token, max_concurrency=8):
+        self.token = token
+        self.session = None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.channels = {}
+
+    async def login(self):
+        """セッションを開いてトークンを検証"""
+        self.session = aiohttp.ClientSession(headers={
+            "Authorization": f"Bot {self.token}",
+            "User-Agent": "Discord-News-Summarizer/1.0"
+        })
+        return await self.request('GET', "/users/@me")
+
+    async def close(self):
+        """セッションを閉じる"""
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, path, **kwargs):
+        """REST APIを呼び出し（レート制限時は待って再試行）"""
+        while True:
+            async with self.semaphore:
+                async with self.session.request(method, API_BASE + path, **kwargs) as response:
+                    if response.status == 429:
+                        retry_after = (await response.json()).get('retry_after', 1)
+                    elif response.status >= 400:
+                        raise RuntimeError(f"Discord API エラー {response.status}: {method} {path}")
+                    else:
+                        return await response.json()
+            await asyncio.sleep(retry_after)
+
+    async def fetch_channel(self, channel_id):
+        """チャンネル情報を取得（プリフェッチ済みならキャッシュを返す）"""
+        if channel_id not in self.channels:
+            data = await self.request('GET', f"/channels/{channel_id}")
+            self.channels[channel_id] = RestChannel(self, data)
+        return self.channels[channel_id]
+
+    async def prefetch_channels(self, channel_ids, guild_id=None):
+        """チャンネル情報をまとめて取得（サーバー指定時は一覧を1回で、残りは並行取得）"""
+        if guild_id:
+            try:
+                for data in await self.request('GET', f"/guilds/{guild_id}/channels"):
+                    channel = RestChannel(self, {**data, 'guild_id': guild_id})
+                    self.channels[channel.id] = channel
+                    # チャンネル名での指定も一覧から解決（テキストチャンネルのみ）
+                    if data.get('type') == 0:
+                        self.channels.setdefault(channel.name, channel)
+            except Exception as e:
+                logger.warning(f"チャンネル一覧の一括取得に失敗: {e}")
+
+        missing = [
+            channel_id for channel_id in channel_ids
+            if channel_id not in self.channels and isinstance(channel_id, int)
+        ]
+        results = await asyncio.gather(
+            *(self.fetch_channel(channel_id) for channel_id in missing), return_exceptions=True
+        )
+        for channel_id, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.warning(f"チャンネル情報の取得に失敗: {channel_id}: {result}")
+        return {channel_id: self.channels[channel_id] for channel_id in channel_ids if channel_id in self.channels}
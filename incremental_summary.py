@@ -0,0 +1,155 @@
+import glob
+import json
+import logging
+import os
+import re
+import time
+from functools import partial
+import config
+from model_router import TEMPLATE_ROUTE, format_messages
+from llm_scheduler import channel_weight
+
+logger = logging.getLogger(__name__)
+
+WHATS_NEW_HEADING = "## 新着"
+RUNNING_SUMMARY_HEADING = "## 最新の要約"
+
+
+class RunningSummaryStore:
+    """チャンネルごとの累積要約（差分要約の前提となる前回の要約）を保存"""
+
+    def __init__(self, state_dir=None):
+        if state_dir is None:
+            state_dir = os.path.join(os.getenv('SUMMARY_DIR', 'summaries'), 'running')
+        self.state_dir = state_dir
+
+    def _path(self, channel_key):
+        return os.path.join(self.state_dir, f"{channel_key}.json")
+
+    def load(self, channel_key, channel_name):
+        """前回の累積要約を取得（なければ要約アーカイブの最新ファイルから）"""
+        path = self._path(channel_key)
+        try:
+            if os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)['running_summary']
+
+            # アーカイブは「チャンネル名_YYYYmmdd_HHMMSS.json」（general_chat_* や topic_* を拾わないように）
+            summary_dir = os.getenv('SUMMARY_DIR', 'summaries')
+            pattern = re.compile(rf"{re.escape(channel_name)}_\d{{8}}_\d{{6}}\.json")
+            archived = sorted(
+                path for path in glob.glob(os.path.join(summary_dir, f"{glob.escape(channel_name)}_*.json"))
+                if pattern.fullmatch(os.path.basename(path))
+            )
+            if archived:
+                with open(archived[-1], 'r', encoding='utf-8') as f:
+                    return json.load(f).get('summary')
+        except Exception as e:
+            logger.error(f"累積要約の読み込みエラー ({channel_key}): {e}")
+        return None
+
+    def save(self, channel_key, running_summary):
+        """累積要約を保存（一時ファイル経由で置き換え）"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._path(channel_key)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'running_summary': running_summary}, f, ensure_ascii=False, indent=2)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            logger.error(f"累積要約の保存エラー ({channel_key}): {e}")
+
+
+def truncate_summary(text, max_chars=None):
+    """累積要約を上限文字数に収める（プロンプトが持ち越し分で増え続けないように）"""
+    if max_chars is None:
+        max_chars = config.RUNNING_SUMMARY_MAX_CHARS
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "…"
+
+
+def build_delta_prompt(channel_name, messages_text, start_time, end_time, previous_summary):
+    """前回の要約と新着メッセージのみから差分要約のプロンプトを作成"""
+    return config.DELTA_SUMMARY_PROMPT.format(
+        channel_name=channel_name,
+        start_time=start_time.strftime("%Y-%m-%d %H:%M:%S"),
+        end_time=end_time.strftime("%Y-%m-%d %H:%M:%S"),
+        previous_summary=truncate_summary(previous_summary) if previous_summary else "（なし）",
+        messages=messages_text,
+        max_chars=config.RUNNING_SUMMARY_MAX_CHARS
+    )
+
+
+def parse_delta_response(text, previous_summary=None):
+    """モデルの出力を（新着, 最新の要約）に分割"""
+    if WHATS_NEW_HEADING in text and RUNNING_SUMMARY_HEADING in text:
+        before, running = text.split(RUNNING_SUMMARY_HEADING, 1)
+        whats_new = before.split(WHATS_NEW_HEADING, 1)[1]
+        return whats_new.strip(), truncate_summary(running.strip())
+
+    # 形式に従わなかった場合は出力全体を新着として扱い、累積要約は前回分を維持
+    logger.warning("差分要約の出力形式を解析できませんでした")
+    return text.strip(), previous_summary or truncate_summary(text.strip())
+
+
+def format_delta_summary(whats_new, running_summary):
+    """投稿・保存用の要約テキスト"""
+    return f"🆕 新着\n{whats_new}\n\n📚 これまでの要約\n{running_summary}"
+
+
+async def summarize_messages(model_router, llm_scheduler, llm_backend, running_summaries, channel_name, messages,
+                             start_time, end_time, channel_id=None, incremental=None, raise_on_error=False):
+    """メッセージを要約して（要約, 累積要約）を返す
+
+    累積要約は保存しない。要約の保存・配信が済んでから呼び出し側で running_summaries.save する
+    （差分要約を使わない場合・テンプレート要約・エラー時は None）。
+    """
+    if not messages:
+        return "この期間中に新しいメッセージはありませんでした。", None
+
+    messages_text = format_messages(messages)
+
+    # 差分要約モードでは前回の累積要約と新着メッセージのみを送る
+    channel_key = channel_id if channel_id is not None else channel_name
+    previous_summary = None
+    if incremental is None:
+        incremental = config.INCREMENTAL_SUMMARY
+    if incremental:
+        previous_summary = running_summaries.load(channel_key, channel_name)
+        prompt = build_delta_prompt(channel_name, messages_text, start_time, end_time, previous_summary)
+    else:
+        prompt = config.SUMMARY_PROMPT.format(
+            channel_name=channel_name,
+            start_time=start_time.strftime("%Y-%m-%d %H:%M:%S"),
+            end_time=end_time.strftime("%Y-%m-%d %H:%M:%S"),
+            messages=messages_text
+        )
+
+    # メッセージ数・トークン概算・優先度からモデルを選択
+    route = model_router.route(channel_name, messages, prompt, channel_id, incremental=incremental)
+    started = time.monotonic()
+    if route['name'] == TEMPLATE_ROUTE:
+        model_router.record(route, time.monotonic() - started)
+        return model_router.template_summary(channel_name, messages), None
+
+    try:
+        # トークン予算内で重み付き公平に送信（上限に達したら失敗させずに待つ）
+        params = model_router.completion_params(route, prompt)
+        response, waited = await llm_scheduler.submit(
+            channel_key,
+            route['prompt_tokens_estimate'] + route['max_tokens'],
+            partial(llm_backend.complete, params),
+            weight=channel_weight(channel_name, channel_id)
+        )
+        model_router.record_response(route, started + waited, response)
+        content = response.choices[0].message.content
+        if incremental:
+            whats_new, running_summary = parse_delta_response(content, previous_summary)
+            return format_delta_summary(whats_new, running_summary), running_summary
+        return content, None
+    except Exception as e:
+        logger.error(f"要約生成エラー: {e}")
+        if raise_on_error:
+            raise
+        return f"要約の生成中にエラーが発生しました: {str(e)}", None
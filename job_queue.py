@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# ステージの順序（上流から下流）
+COLLECT_STAGE = 'collect'
+SUMMARIZE_STAGE = 'summarize'
+DELIVER_STAGE = 'deliver'
+STAGES = [COLLECT_STAGE, SUMMARIZE_STAGE, DELIVER_STAGE]
+
+
+class JobQueue:
+    """ステージ間で受け渡すジョブを保存する永続キュー（SQLite）"""
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, stage TEXT NOT NULL, payload TEXT NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+                "available_at REAL NOT NULL, claimed_by TEXT, last_error TEXT, "
+                "dedupe_key TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (stage, status, available_at)")
+            # 同じ dedupe_key のジョブは未完了のものを1件だけ許可する
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key) "
+                "WHERE status IN ('pending', 'running')"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cursors (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def connect(self):
+        """接続を作成（autocommit、トランザクションは明示的に開始）"""
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _insert(self, conn, stage, payload, dedupe_key=None):
+        now = time.time()
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO jobs (stage, payload, available_at, dedupe_key, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (stage, json.dumps(payload, ensure_ascii=False), now, dedupe_key, now, now)
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def enqueue(self, stage, payload, dedupe_key=None):
+        """ジョブを追加（同じ dedupe_key の未完了ジョブがあれば追加しない）"""
+        with closing(self.connect()) as conn:
+            return self._insert(conn, stage, payload, dedupe_key)
+
+    def claim(self, stage, worker_id, visibility_seconds):
+        """実行可能なジョブを1件取得（期限切れの実行中ジョブも再取得）"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE stage = ? AND status IN ('pending', 'running') "
+                "AND available_at <= ? ORDER BY available_at, id LIMIT 1",
+                (stage, now)
+            ).fetchone()
+            if not row:
+                conn.execute("ROLLBACK")
+                return None
+            job_id, payload, attempts = row
+            # 実行中の間は available_at を可視性タイムアウトとして使う
+            conn.execute(
+                "UPDATE jobs SET status = 'running', claimed_by = ?, available_at = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now + visibility_seconds, now, job_id)
+            )
+            conn.execute("COMMIT")
+            return {'id': job_id, 'stage': stage, 'payload': json.loads(payload), 'attempts': attempts}
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def complete(self, job_id, next_jobs=(), cursor=None):
+        """ジョブを完了し、次ステージのジョブとカーソルを同じトランザクションで保存"""
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for stage, payload, dedupe_key in next_jobs:
+                self._insert(conn, stage, payload, dedupe_key)
+            if cursor:
+                conn.execute(
+                    "INSERT INTO cursors (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    cursor
+                )
+            conn.execute(
+                "UPDATE jobs SET status = 'done', payload = '{}', updated_at = ? WHERE id = ?",
+                (time.time(), job_id)
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def fail(self, job_id, error, max_attempts, backoff_seconds, defer_seconds=None):
+        """失敗を記録し、指数バックオフで再試行、上限を超えたらデッドレターへ
+
+        defer_seconds 指定時は少なくともその秒数後まで再試行しない（次回の実行に持ち越す）。
+        """
+        now = time.time()
+        with closing(self.connect()) as conn:
+            attempts = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] + 1
+            if attempts >= max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = 'dead', attempts = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                    (attempts, error, now, job_id)
+                )
+                return 'dead'
+            delay = backoff_seconds * (2 ** (attempts - 1))
+            if defer_seconds is not None:
+                delay = max(delay, defer_seconds)
+            conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = ?, last_error = ?, available_at = ?, updated_at = ? "
+                "WHERE id = ?",
+                (attempts, error, now + delay, now, job_id)
+            )
+            return 'deferred' if defer_seconds is not None else 'retry'
+
+    def has_active(self, stages, horizon_seconds, run_id):
+        """指定ステージに今回の実行で処理中、または horizon 秒以内に実行可能になるジョブがあるか"""
+        placeholders = ",".join("?" for _ in stages)
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE stage IN ({placeholders}) AND "
+                f"((status = 'running' AND claimed_by LIKE ?) OR "
+                f"(status IN ('pending', 'running') AND available_at <= ?))",
+                (*stages, f"{run_id}:%", time.time() + horizon_seconds)
+            ).fetchone()
+        return row[0] > 0
+
+    def get_cursor(self, key):
+        """ステージ間で共有するカーソル値を取得"""
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT value FROM cursors WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def dead_letters(self):
+        """デッドレターのジョブ一覧"""
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, stage, attempts, last_error FROM jobs WHERE status = 'dead' ORDER BY id"
+            ).fetchall()
+        return [{'id': r[0], 'stage': r[1], 'attempts': r[2], 'last_error': r[3]} for r in rows]
+
+    def requeue_dead(self):
+        """デッドレターのジョブを再投入"""
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE OR IGNORE jobs SET status = 'pending', attempts = 0, available_at = ?, updated_at = ? "
+                "WHERE status = 'dead'",
+                (time.time(), time.time())
+            )
+            return cursor.rowcount
+
+    def stats(self):
+        """ステージ・状態ごとのジョブ数"""
+        with closing(self.connect()) as conn:
+            rows = conn.execute("SELECT stage, status, COUNT(*) FROM jobs GROUP BY stage, status").fetchall()
+        stats = {}
+        for stage, status, count in rows:
+            stats.setdefault(stage, {})[status] = count
+        return stats
+
+
+class JobPipeline:
+    """ステージごとのワーカープールでキューを処理する"""
+
+    def __init__(self, queue, max_attempts=10, backoff_seconds=5, visibility_seconds=600, max_wait_seconds=60,
+                 attempts_per_run=2):
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.attempts_per_run = attempts_per_run
+        # 今回の実行でのジョブごとの失敗回数（上限に達したら次回の実行に持ち越す）
+        self.run_failures = {}
+        self.backoff_seconds = backoff_seconds
+        self.visibility_seconds = visibility_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.run_id = f"run-{int(time.time() * 1000)}"
+
+    async def stage_worker(self, stage, worker_id, handler):
+        """1つのステージのジョブを処理し続け、上流も含めて処理待ちがなくなれば終了"""
+        upstream = STAGES[:STAGES.index(stage) + 1]
+        processed = 0
+        while True:
+            job = self.queue.claim(stage, worker_id, self.visibility_seconds)
+            if job is None:
+                # バックオフが max_wait_seconds を超えるジョブは次回の実行に持ち越す
+                if not self.queue.has_active(upstream, self.max_wait_seconds, self.run_id):
+                    return processed
+                await asyncio.sleep(1)
+                continue
+
+            try:
+                next_jobs, cursor = await handler(job['payload'])
+                self.queue.complete(job['id'], next_jobs, cursor)
+                processed += 1
+            except Exception as e:
+                # 障害が長引いても1回の実行で試行を使い切らないよう、上限に達したら horizon の外へ延ばす
+                failures = self.run_failures.get(job['id'], 0) + 1
+                self.run_failures[job['id']] = failures
+                defer_seconds = None
+                if self.attempts_per_run and failures >= self.attempts_per_run:
+                    defer_seconds = self.max_wait_seconds + 1
+                result = self.queue.fail(job['id'], str(e), self.max_attempts, self.backoff_seconds, defer_seconds)
+                if result == 'dead':
+                    logger.error(f"[{stage}] ジョブ {job['id']} をデッドレターへ移動: {e}")
+                elif result == 'deferred':
+                    logger.warning(f"[{stage}] ジョブ {job['id']} を次回の実行に持ち越し ({job['attempts'] + 1}回目の失敗): {e}")
+                else:
+                    logger.warning(f"[{stage}] ジョブ {job['id']} を再試行予定 ({job['attempts'] + 1}回目の失敗): {e}")
+
+    async def run(self, handlers):
+        """handlers: {stage: (handler, ワーカー数)} を並行実行"""
+        tasks = []
+        for stage, (handler, workers) in handlers.items():
+            for index in range(workers):
+                tasks.append(asyncio.create_task(self.stage_worker(stage, f"{self.run_id}:{stage}-{index}", handler)))
+        results = await asyncio.gather(*tasks)
+        return sum(results)
@@ -0,0 +1,215 @@
+import asyncio
+import collections
+import json
+import logging
+import math
+import os
+import time
+import config
+from model_router import estimate_cost
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, pct):
+    """値の一覧からパーセンタイルを計算（最近傍法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+def parse_endpoints():
+    """LLM_ENDPOINTS（JSON）からエンドポイント一覧を作成、未指定時はOpenAIのみ"""
+    raw = os.getenv('LLM_ENDPOINTS', '').strip()
+    if not raw:
+        return [Endpoint('openai', None, config.OPENAI_API_KEY)]
+
+    endpoints = []
+    for item in json.loads(raw):
+        api_key = os.getenv(item.get('api_key_env', 'OPENAI_API_KEY'), '')
+        endpoints.append(Endpoint(item['name'], item.get('base_url'), api_key, item.get('model')))
+    return endpoints
+
+
+class Endpoint:
+    """OpenAI互換のエンドポイント（サーキットブレーカー付き）"""
+
+    def __init__(self, name, base_url, api_key, model=None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.client = None
+        self.failures = 0
+        self.open_until = 0.0
+
+    def available(self):
+        """ブレーカーが閉じている（またはクールダウン明けで試行可能）か"""
+        return time.monotonic() >= self.open_until
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= config.LLM_BREAKER_FAILURES:
+            self.open_until = time.monotonic() + config.LLM_BREAKER_COOLDOWN_SECONDS
+            logger.warning(f"エンドポイント {self.name} のブレーカーを開きました（{self.failures}回連続失敗）")
+
+    def create(self, params):
+        """Chat Completions を同期で呼び出し（openai SDK 1.x / 0.28 の両方に対応）"""
+        import openai
+        if self.model:
+            params = {**params, 'model': self.model}
+
+        if hasattr(openai, 'OpenAI'):
+            if self.client is None:
+                kwargs = {'api_key': self.api_key}
+                if self.base_url:
+                    kwargs['base_url'] = self.base_url
+                self.client = openai.OpenAI(**kwargs)
+            return self.client.chat.completions.create(**params)
+
+        kwargs = {'api_key': self.api_key}
+        if self.base_url:
+            kwargs['api_base'] = self.base_url
+        return openai.ChatCompletion.create(**kwargs, **params)
+
+
+class HedgedBackend:
+    """複数エンドポイントへの要約リクエスト（遅延時のヘッジ送信・失敗時のフェイルオーバー）"""
+
+    def __init__(self, endpoints=None):
+        self.endpoints = endpoints if endpoints is not None else parse_endpoints()
+        self.latencies = collections.deque(maxlen=200)
+        self.durations = []
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedge_cost = 0.0
+        self.background = set()
+
+    def hedge_delay(self):
+        """ヘッジ送信までの待ち時間（観測したレイテンシのパーセンタイル）"""
+        if len(self.latencies) < config.LLM_HEDGE_MIN_SAMPLES:
+            return config.LLM_HEDGE_INITIAL_DELAY_SECONDS
+        return percentile(self.latencies, config.LLM_HEDGE_PERCENTILE)
+
+    def candidates(self):
+        """ブレーカーが開いていないエンドポイント（全て開いていれば全て）"""
+        available = [endpoint for endpoint in self.endpoints if endpoint.available()]
+        return available or list(self.endpoints)
+
+    async def attempt(self, endpoint, params):
+        """1つのエンドポイントに送信し、結果とブレーカー状態を記録"""
+        started = time.monotonic()
+        try:
+            response = await asyncio.to_thread(endpoint.create, params)
+        except Exception as e:
+            endpoint.record_failure()
+            logger.warning(f"エンドポイント {endpoint.name} でエラー: {e}")
+            raise
+        endpoint.record_success()
+        self.latencies.append(time.monotonic() - started)
+        return response
+
+    def track_loser(self, task, model):
+        """採用されなかったヘッジの使用量を追加コストとして記録"""
+        def done(finished):
+            self.background.discard(finished)
+            if finished.cancelled() or finished.exception():
+                return
+            usage = getattr(finished.result(), 'usage', None)
+            if usage:
+                self.hedge_cost += estimate_cost(
+                    model, getattr(usage, 'prompt_tokens', 0) or 0, getattr(usage, 'completion_tokens', 0) or 0
+                )
+        self.background.add(task)
+        task.add_done_callback(done)
+
+    async def complete(self, params):
+        """要約を生成（最初に返った応答を採用）"""
+        started = time.monotonic()
+        deadline = started + config.LLM_REQUEST_TIMEOUT_SECONDS
+        endpoints = self.candidates()
+        # 失敗時は別のエンドポイントへ（1つしかなければ同じエンドポイントへ1回だけ再送）
+        max_attempts = max(2, len(endpoints))
+        pending = {}
+        attempts = 0
+        hedge_task = None
+        last_error = None
+
+        def launch():
+            nonlocal attempts
+            endpoint = endpoints[attempts % len(endpoints)]
+            attempts += 1
+            task = asyncio.create_task(self.attempt(endpoint, params))
+            pending[task] = endpoint
+            return task
+
+        launch()
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(
+                        f"要約リクエストが {config.LLM_REQUEST_TIMEOUT_SECONDS}s 以内に完了しませんでした"
+                    )
+
+                # パーセンタイルを超えても応答がなければ、別のエンドポイントにも同じリクエストを送る
+                timeout = remaining
+                if hedge_task is None:
+                    timeout = min(remaining, max(0.0, started + self.hedge_delay() - time.monotonic()))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if hedge_task is None:
+                        hedge_task = launch()
+                        self.hedges += 1
+                        logger.info(f"ヘッジリクエストを送信: {pending[hedge_task].name}")
+                    continue
+
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+
+                if not pending and attempts < max_attempts:
+                    launch()
+            raise last_error
+        finally:
+            self.durations.append(time.monotonic() - started)
+            # 採用されなかったリクエストはスレッド上で完了まで走るため、使用量だけ記録する
+            for task, endpoint in pending.items():
+                self.track_loser(task, endpoint.model or params['model'])
+
+    async def drain(self, timeout=None):
+        """採用されなかったリクエストの完了を待つ（1回だけ実行する場合にレポート前に追加コストを確定させる）"""
+        if not self.background:
+            return
+        if timeout is None:
+            timeout = config.LLM_REQUEST_TIMEOUT_SECONDS
+        await asyncio.wait(set(self.background), timeout=timeout)
+
+    def report(self):
+        """p50/p99のレイテンシとヘッジの追加コスト"""
+        if not self.durations:
+            return []
+        hedge_line = f"ヘッジ {self.hedges}件（採用 {self.hedge_wins}件）, 追加コスト ${self.hedge_cost:.4f}"
+        if self.background:
+            # 実行中のリクエストの使用量は完了するまで追加コストに含まれない
+            hedge_line += f"（実行中 {len(self.background)}件は未計上）"
+        lines = [
+            f"要約リクエスト {len(self.durations)}件, p50 {percentile(self.durations, 50):.2f}s, "
+            f"p99 {percentile(self.durations, 99):.2f}s, 最大 {max(self.durations):.2f}s",
+            hedge_line,
+        ]
+        opened = [endpoint.name for endpoint in self.endpoints if not endpoint.available()]
+        if opened:
+            lines.append(f"ブレーカー遮断中: {', '.join(opened)}")
+        return lines
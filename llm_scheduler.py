@@ -0,0 +1,203 @@
+import asyncio
+import itertools
+import logging
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+# レート制限エラー時の再試行
+RATE_LIMIT_RETRIES = 6
+RATE_LIMIT_BACKOFF_SECONDS = 2
+
+
+class TokenBucket:
+    """1分あたりの上限から補充されるトークンバケット"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """amount を消費できるまでの待ち時間（秒）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        """トークンを消費"""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """見積もりと実際の使用量の差を反映（負なら返却）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def channel_weight(channel_name, channel_id=None):
+    """チャンネルの重みを取得（未指定は1）"""
+    if channel_id is not None and channel_id in config.CHANNEL_WEIGHTS:
+        return config.CHANNEL_WEIGHTS[channel_id]
+    return config.CHANNEL_WEIGHTS.get(channel_name, 1.0)
+
+
+def is_rate_limit_error(error):
+    """OpenAIのレート制限エラーか（SDKのバージョンに依存しない判定）"""
+    status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+    return status == 429 or type(error).__name__ == 'RateLimitError'
+
+
+class LLMScheduler:
+    """TPM/RPMのトークンバケットと重み付き公平キューでLLM呼び出しを順番に送る"""
+
+    def __init__(self, tpm_limit=None, rpm_limit=None, deadline_seconds=None):
+        tpm_limit = config.LLM_TPM_LIMIT if tpm_limit is None else tpm_limit
+        rpm_limit = config.LLM_RPM_LIMIT if rpm_limit is None else rpm_limit
+        self.tokens = TokenBucket(tpm_limit) if tpm_limit else None
+        self.requests = TokenBucket(rpm_limit) if rpm_limit else None
+        self.deadline_seconds = config.LLM_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+        self.pending = []
+        self.sequence = itertools.count()
+        self.virtual_time = 0.0
+        self.last_finish = {}
+        self.wakeup = None
+        self.dispatcher = None
+        self.background = set()
+        self.waits = {}
+
+    async def submit(self, job_key, estimated_tokens, call, weight=1.0, deadline_seconds=None):
+        """LLM呼び出しを予約し、（レスポンス, キュー待ち時間）を返す"""
+        loop = asyncio.get_running_loop()
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+
+        # 重み付き公平キュー: チャンネルごとの仮想終了時刻が小さい順に送る
+        start_tag = max(self.virtual_time, self.last_finish.get(job_key, 0.0))
+        finish_tag = start_tag + estimated_tokens / max(weight, 0.01)
+        self.last_finish[job_key] = finish_tag
+
+        job = {
+            'key': job_key,
+            'tokens': estimated_tokens,
+            'call': call,
+            'start_tag': start_tag,
+            'finish_tag': finish_tag,
+            'deadline': time.monotonic() + deadline_seconds,
+            'submitted': time.monotonic(),
+            'sequence': next(self.sequence),
+            'future': loop.create_future(),
+        }
+        self.pending.append(job)
+
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        self.wakeup.set()
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.dispatch_loop())
+
+        return await job['future']
+
+    def pick(self):
+        """次に送るジョブを選択（期限を過ぎたジョブは期限順、それ以外は仮想終了時刻順）"""
+        now = time.monotonic()
+        overdue = [job for job in self.pending if job['deadline'] <= now]
+        if overdue:
+            return min(overdue, key=lambda job: (job['deadline'], job['sequence']))
+        return min(self.pending, key=lambda job: (job['finish_tag'], job['sequence']))
+
+    def delay_for(self, job):
+        """バケットが job を受け入れられるまでの待ち時間"""
+        delays = [0.0]
+        if self.tokens:
+            delays.append(self.tokens.delay(job['tokens']))
+        if self.requests:
+            delays.append(self.requests.delay(1))
+        return max(delays)
+
+    async def dispatch_loop(self):
+        """待ち行列が空になるまでバケットの範囲内でジョブを送り出す"""
+        while self.pending:
+            job = self.pick()
+            delay = self.delay_for(job)
+            if delay > 0:
+                # 待っている間により優先度の高いジョブが来たら選び直す
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=min(delay, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.pending.remove(job)
+            if self.tokens:
+                self.tokens.consume(job['tokens'])
+            if self.requests:
+                self.requests.consume(1)
+            self.virtual_time = max(self.virtual_time, job['start_tag'])
+
+            waited = time.monotonic() - job['submitted']
+            self.waits.setdefault(job['key'], []).append(waited)
+            # 実行中のタスクは参照を保持しておく（途中でガベージコレクションされないように）
+            task = asyncio.create_task(self.run_job(job, waited))
+            self.background.add(task)
+            task.add_done_callback(self.background.discard)
+
+    async def call_with_retries(self, job):
+        """LLMを呼び出す（レート制限エラーは失敗にせず待って再試行）"""
+        for attempt in range(RATE_LIMIT_RETRIES):
+            try:
+                if asyncio.iscoroutinefunction(job['call']):
+                    return await job['call']()
+                return await asyncio.to_thread(job['call'])
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == RATE_LIMIT_RETRIES - 1:
+                    raise
+                backoff = RATE_LIMIT_BACKOFF_SECONDS * (2 ** attempt)
+                logger.warning(f"レート制限のため {backoff}s 待って再試行: {job['key']}")
+                await asyncio.sleep(backoff)
+
+    async def run_job(self, job, waited):
+        """ジョブを実行し、成功・失敗・キャンセルのいずれでも future を解決する（submit が待ち続けないように）"""
+        try:
+            response = await self.call_with_retries(job)
+        except asyncio.CancelledError:
+            if not job['future'].done():
+                job['future'].cancel()
+            raise
+        except Exception as e:
+            if not job['future'].done():
+                job['future'].set_exception(e)
+            return
+
+        try:
+            # 見積もりと実際の使用量の差をバケットに反映
+            usage = getattr(response, 'usage', None)
+            total_tokens = getattr(usage, 'total_tokens', None) if usage else None
+            if self.tokens and total_tokens:
+                self.tokens.adjust(total_tokens - min(job['tokens'], self.tokens.capacity))
+        except Exception as e:
+            logger.warning(f"使用トークンの反映エラー: {job['key']}: {e}")
+
+        if not job['future'].done():
+            job['future'].set_result((response, waited))
+
+    def report(self):
+        """チャンネルごとのキュー待ち時間レポート"""
+        lines = []
+        all_waits = []
+        for key, waits in sorted(self.waits.items(), key=lambda item: str(item[0])):
+            all_waits.extend(waits)
+            lines.append(f"{key}: {len(waits)}件, 平均待ち {sum(waits) / len(waits):.2f}s, 最大 {max(waits):.2f}s")
+        if all_waits:
+            lines.insert(0, f"全体: {len(all_waits)}件, 平均待ち {sum(all_waits) / len(all_waits):.2f}s, 最大 {max(all_waits):.2f}s")
+        return lines
@@ -6,8 +6,15 @@ import json
 import logging
 import os
 from datetime import datetime, timedelta
-from openai import OpenAI
 import config
+from model_router import ModelRouter
+from llm_backend import HedgedBackend
+from llm_scheduler import LLMScheduler
+from incremental_summary import RunningSummaryStore, summarize_messages
+from topic_clustering import TopicClusterer, topic_references
+from attachments import AttachmentExtractor, describe_attachment
+from runtime_config import RuntimeConfig
+from bot_profile import bot_options
 
 # ログ設定
 log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -24,13 +31,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Discord Bot設定
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Discord Bot設定（BOT_LOW_MEMORY=true でIntentsとキャッシュを絞る）
+bot = commands.Bot(command_prefix='!', **bot_options())
 
-# OpenAI Client
-openai_client = OpenAI(api_key=config.OPENAI_API_KEY)
+# OpenAI互換エンドポイント（ヘッジ送信・フェイルオーバー付き）
+llm_backend = HedgedBackend()
+
+# モデルルーター（ルートごとのレイテンシ・費用を集計）
+model_router = ModelRouter()
+
+# LLM呼び出しのトークン予算（TPM/RPM）と公平キュー
+llm_scheduler = LLMScheduler()
+
+# 差分要約用のチャンネルごとの累積要約
+running_summaries = RunningSummaryStore()
+
+# チャンネル横断のトピック集約（埋め込みはキャッシュ済みなら再計算しない）
+topic_clusterer = TopicClusterer() if config.TOPIC_CLUSTERING else None
+
+# 添付ファイルのテキスト抽出（添付ファイルID・内容ハッシュでキャッシュ）
+attachment_extractor = AttachmentExtractor() if config.ATTACHMENT_EXTRACTION else None
+
+# 実行中に再読み込みする設定（起動時にも一度反映してから要約ループの間隔を決める）
+runtime_config = RuntimeConfig(config.RUNTIME_CONFIG_FILE) if config.RUNTIME_CONFIG_FILE else None
+if runtime_config:
+    runtime_config.reload()
+
+# 要約の実行中は設定を切り替えない（1回の要約は同じ設定で最後まで処理する）
+config_lock = asyncio.Lock()
+
+# 監視対象の指定（チャンネルID・チャンネル名）から解決したチャンネルID
+resolved_channels = {}
 
 # 最後に要約した時刻を記録
 last_summary_time = {}
@@ -62,6 +93,7 @@ class DiscordNewsBot:
                         'content': message.content,
                         'timestamp': message.created_at.isoformat(),
                         'attachments': [att.url for att in message.attachments],
+                        'attachment_files': [describe_attachment(att) for att in message.attachments],
                         'replies': len(message.replies) if hasattr(message, 'replies') else 0
                     })
                     
@@ -70,42 +102,19 @@ class DiscordNewsBot:
             
         # 時系列順にソート
         messages.sort(key=lambda x: x['timestamp'])
+        
+        # 添付ファイルの内容を要約対象に追加
+        if attachment_extractor:
+            await attachment_extractor.enrich(messages)
         return messages
     
-    async def generate_summary(self, channel_name, messages, start_time, end_time):
-        """GPT APIを使用してメッセージを要約"""
-        if not messages:
-            return "この期間中に新しいメッセージはありませんでした。"
-        
-        # メッセージを文字列形式に変換
-        messages_text = "\n".join([
-            f"[{msg['timestamp']}] {msg['author']}: {msg['content']}"
-            for msg in messages
-        ])
-        
-        prompt = config.SUMMARY_PROMPT.format(
-            channel_name=channel_name,
-            start_time=start_time.strftime("%Y-%m-%d %H:%M:%S"),
-            end_time=end_time.strftime("%Y-%m-%d %H:%M:%S"),
-            messages=messages_text
+    async def generate_summary(self, channel_name, messages, start_time, end_time, channel_id=None, incremental=None, raise_on_error=False):
+        """GPT APIを使用してメッセージを要約し、（要約, 累積要約）を返す（累積要約は要約の保存後に保存する）"""
+        return await summarize_messages(
+            model_router, llm_scheduler, llm_backend, running_summaries,
+            channel_name, messages, start_time, end_time, channel_id,
+            incremental=incremental, raise_on_error=raise_on_error
         )
-        
-        try:
-            response = openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "あなたはDiscordの議論内容を要約する専門アシスタントです。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            logger.error(f"要約生成エラー: {e}")
-            return f"要約の生成中にエラーが発生しました: {str(e)}"
     
     async def save_summary(self, channel_name, summary, messages_count):
         """要約をファイルに保存"""
@@ -125,8 +134,10 @@ class DiscordNewsBot:
             async with aiofiles.open(filename, 'w', encoding='utf-8') as f:
                 await f.write(json.dumps(summary_data, ensure_ascii=False, indent=2))
             logger.info(f"要約をファイルに保存: {filename}")
+            return filename
         except Exception as e:
             logger.error(f"ファイル保存エラー: {e}")
+            return None
 
     async def post_summary_to_channel(self, summary_channel, channel_name, summary, messages_count):
         """要約を指定チャンネルに投稿"""
@@ -157,11 +168,68 @@ async def on_ready():
     if not summary_task.is_running():
         summary_task.start()
     
+    # 設定ファイルの監視を開始（再接続時に二重起動しない）
+    if runtime_config and not config_watch_task.is_running():
+        config_watch_task.start()
+    
     logger.info(f"要約タスクを開始しました（{config.SUMMARY_INTERVAL_HOURS}時間間隔）")
 
+def resolve_channels(guild):
+    """監視対象チャンネルを解決（設定変更時は追加・削除された指定のみ処理）"""
+    entries = list(config.CHANNEL_IDS)
+    for entry in list(resolved_channels):
+        if entry not in entries:
+            resolved_channels.pop(entry)
+            logger.info(f"監視対象から削除: {entry}")
+    
+    for entry in entries:
+        if entry in resolved_channels:
+            continue
+        if isinstance(entry, int):
+            channel = bot.get_channel(entry)
+        else:
+            channel = discord.utils.get(guild.text_channels, name=entry)
+        if channel:
+            resolved_channels[entry] = channel.id
+            logger.info(f"監視対象に追加: {entry} → {channel.name} ({channel.id})")
+    
+    channels = []
+    for entry in entries:
+        channel = bot.get_channel(resolved_channels[entry]) if entry in resolved_channels else None
+        if channel:
+            channels.append(channel)
+        else:
+            logger.warning(f"チャンネルが見つかりません: {entry}")
+    return channels
+
 @tasks.loop(hours=config.SUMMARY_INTERVAL_HOURS)
 async def summary_task():
     """定期的にチャンネルの要約を実行"""
+    async with config_lock:
+        await run_summaries()
+
+@tasks.loop(seconds=config.RUNTIME_CONFIG_POLL_SECONDS)
+async def config_watch_task():
+    """設定ファイルの変更を監視して反映（Gatewayに再接続せずに切り替える）"""
+    try:
+        # 実行中の要約が終わるまで待ってから切り替える
+        async with config_lock:
+            changes = runtime_config.reload()
+        
+        if 'SUMMARY_INTERVAL_HOURS' in changes:
+            # 次回の実行時刻を新しい間隔で計算し直す（実行中の要約は中断しない）
+            summary_task.change_interval(hours=config.SUMMARY_INTERVAL_HOURS)
+            logger.info(f"要約間隔を変更: {config.SUMMARY_INTERVAL_HOURS}時間（次回: {summary_task.next_iteration}）")
+        
+        if 'CHANNEL_IDS' in changes:
+            guild = bot.get_guild(config.GUILD_ID)
+            if guild:
+                resolve_channels(guild)
+    except Exception as e:
+        logger.error(f"設定の再読み込みエラー: {e}")
+
+async def run_summaries():
+    """全チャンネルの要約を1回実行"""
     try:
         guild = bot.get_guild(config.GUILD_ID)
         if not guild:
@@ -175,12 +243,9 @@ async def summary_task():
         
         current_time = datetime.utcnow()
         
-        for channel_id in config.CHANNEL_IDS:
-            channel = bot.get_channel(channel_id)
-            if not channel:
-                logger.warning(f"チャンネルが見つかりません: {channel_id}")
-                continue
-            
+        # 全チャンネルのメッセージを先に取得（チャンネル横断のトピック集約のため）
+        collected = []
+        for channel in resolve_channels(guild):
             logger.info(f"チャンネル {channel.name} の要約を開始")
             
             # メッセージを取得
@@ -188,26 +253,87 @@ async def summary_task():
             
             if messages:
                 start_time = last_summary_time.get(channel.id, current_time - timedelta(hours=config.SUMMARY_INTERVAL_HOURS))
-                
-                # 要約を生成
-                summary = await news_bot.generate_summary(
-                    channel.name, messages, start_time, current_time
-                )
-                
-                # ファイルに保存
-                await news_bot.save_summary(channel.name, summary, len(messages))
-                
-                # チャンネルに投稿
-                await news_bot.post_summary_to_channel(
-                    summary_channel, channel.name, summary, len(messages)
-                )
-                
-                # 最後の要約時刻を更新
-                last_summary_time[channel.id] = current_time
+                collected.append((channel, messages, start_time))
             else:
                 logger.info(f"チャンネル {channel.name} に新しいメッセージはありません")
         
+        # 複数チャンネルで同じ話題が出ていれば、その話題は1回だけ要約して投稿
+        topics = []
+        if config.TOPIC_CLUSTERING and len(collected) >= 2:
+            try:
+                topics, remaining = await asyncio.to_thread(
+                    topic_clusterer.find_topics,
+                    {channel.id: messages for channel, messages, _ in collected},
+                    {channel.id: channel.name for channel, _, _ in collected}
+                )
+                collected = [
+                    (channel, remaining[channel.id], start_time)
+                    for channel, _, start_time in collected
+                ]
+            except Exception as e:
+                logger.error(f"トピック集約エラー: {e}")
+        
+        # 共通トピックと各チャンネルの要約をまとめて送信し、LLMキューで重み付き公平に処理させる
+        topic_jobs = []
+        for topic in topics:
+            topic_name = f"共通トピック #{topic['id']}（{', '.join(topic['channel_names'])}）"
+            start_time = min(start for channel, _, start in collected if channel.id in topic['channels'])
+            topic_jobs.append((topic, topic_name, start_time))
+        channel_jobs = [(channel, messages, start_time) for channel, messages, start_time in collected if messages]
+        results = await asyncio.gather(
+            *(
+                news_bot.generate_summary(topic_name, topic['messages'], start_time, current_time, incremental=False)
+                for topic, topic_name, _ in topic_jobs
+            ),
+            *(
+                news_bot.generate_summary(channel.name, messages, start_time, current_time, channel.id)
+                for channel, messages, start_time in channel_jobs
+            )
+        )
+        channel_results = {
+            channel.id: result for (channel, _, _), result in zip(channel_jobs, results[len(topic_jobs):])
+        }
+        
+        # 保存・投稿はチャンネルの順に行う
+        for (topic, topic_name, _), (summary, _) in zip(topic_jobs, results):
+            await news_bot.save_summary(f"topic_{topic['id']}", summary, len(topic['messages']))
+            await news_bot.post_summary_to_channel(
+                summary_channel, f"🔗 {topic_name}", summary, len(topic['messages'])
+            )
+        
+        for channel, messages, _ in collected:
+            references = topic_references(topics, channel.id)
+            running_summary = None
+            if messages:
+                summary, running_summary = channel_results[channel.id]
+                if references:
+                    summary = f"{summary}\n\n{references}"
+            else:
+                # 全メッセージが共通トピックに含まれた場合は参照のみ
+                summary = references
+            
+            # ファイルに保存
+            filename = await news_bot.save_summary(channel.name, summary, len(messages))
+            
+            # チャンネルに投稿
+            await news_bot.post_summary_to_channel(
+                summary_channel, channel.name, summary, len(messages)
+            )
+            
+            # 要約を保存できた場合のみ累積要約を更新（次回の差分要約の前提になるため）
+            if filename and running_summary:
+                running_summaries.save(channel.id, running_summary)
+            
+            # 最後の要約時刻を更新
+            last_summary_time[channel.id] = current_time
+        
         logger.info("全チャンネルの要約が完了しました")
+        for line in model_router.report():
+            logger.info(f"ルート統計: {line}")
+        for line in llm_scheduler.report():
+            logger.info(f"LLMキュー待ち: {line}")
+        for line in llm_backend.report():
+            logger.info(f"LLMレイテンシ: {line}")
         
     except Exception as e:
         logger.error(f"要約タスクエラー: {e}")
@@ -240,9 +366,9 @@ async def manual_summary(ctx, channel_id: int = None, hours: int = None):
         current_time = datetime.utcnow()
         start_time = current_time - timedelta(hours=hours)
         
-        # 要約を生成
-        summary = await news_bot.generate_summary(
-            channel.name, messages, start_time, current_time
+        # 要約を生成（指定期間の単独の要約。定期要約の累積要約は使わず、更新もしない）
+        summary, _ = await news_bot.generate_summary(
+            channel.name, messages, start_time, current_time, channel.id, incremental=False
         )
         
         # ファイルに保存
@@ -276,6 +402,8 @@ async def status(ctx):
     embed.add_field(name="📊 監視中チャンネル数", value=f"{len(config.CHANNEL_IDS)}個", inline=True)
     embed.add_field(name="⏰ 要約間隔", value=f"{config.SUMMARY_INTERVAL_HOURS}時間", inline=True)
     embed.add_field(name="🔄 タスク状況", value="実行中" if summary_task.is_running() else "停止中", inline=True)
+    if runtime_config:
+        embed.add_field(name="⚙️ 設定バージョン", value=f"v{runtime_config.version}", inline=True)
     
     # 最後の要約時刻を表示
     if last_summary_time:
@@ -285,8 +413,63 @@ async def status(ctx):
         ])
         embed.add_field(name="📅 最後の要約時刻", value=last_times or "まだ要約を実行していません", inline=False)
     
+    # ルートごとのレイテンシ・費用を表示
+    route_report = model_router.report()
+    if route_report:
+        embed.add_field(name="🧭 モデルルート統計", value="\n".join(route_report), inline=False)
+    
+    # LLM呼び出しのキュー待ち時間を表示
+    queue_report = llm_scheduler.report()
+    if queue_report:
+        embed.add_field(name="⏳ LLMキュー待ち", value="\n".join(queue_report[:10]), inline=False)
+    
+    # 要約リクエストのp99レイテンシとヘッジの追加コストを表示
+    backend_report = llm_backend.report()
+    if backend_report:
+        embed.add_field(name="🛰️ LLMレイテンシ", value="\n".join(backend_report), inline=False)
+    
+    await ctx.send(embed=embed)
+
+@bot.command(name='config')
+@commands.is_owner()
+async def config_status(ctx):
+    """適用中の設定バージョンを確認（オーナーのみ）"""
+    embed = discord.Embed(
+        title="⚙️ 適用中の設定",
+        color=0x0099ff,
+        timestamp=datetime.utcnow()
+    )
+    
+    if runtime_config:
+        embed.add_field(name="📄 設定ファイル", value=runtime_config.path, inline=False)
+        embed.add_field(name="🔢 バージョン", value=f"v{runtime_config.version}", inline=True)
+        embed.add_field(name="#️⃣ ハッシュ", value=(runtime_config.digest or "なし")[:12], inline=True)
+        loaded_at = runtime_config.loaded_at.strftime("%Y-%m-%d %H:%M:%S") if runtime_config.loaded_at else "未読み込み"
+        embed.add_field(name="🕒 反映時刻", value=loaded_at, inline=True)
+        if runtime_config.last_error:
+            embed.add_field(name="⚠️ 直近の読み込みエラー（未反映）", value=runtime_config.last_error[:1000], inline=False)
+    else:
+        embed.add_field(name="📄 設定ファイル", value="未設定（RUNTIME_CONFIG_FILE）", inline=False)
+    
+    channels = ", ".join(
+        f"<#{resolved_channels[entry]}>" if entry in resolved_channels else f"{entry}（未解決）"
+        for entry in config.CHANNEL_IDS
+    )
+    embed.add_field(name="📊 監視中チャンネル", value=channels[:1000] or "なし", inline=False)
+    embed.add_field(name="⏰ 要約間隔", value=f"{config.SUMMARY_INTERVAL_HOURS}時間", inline=True)
+    embed.add_field(name="📝 最大メッセージ数", value=f"{config.MAX_MESSAGES_PER_CHANNEL}件", inline=True)
+    if summary_task.next_iteration:
+        embed.add_field(name="⏭️ 次回の要約", value=summary_task.next_iteration.strftime("%Y-%m-%d %H:%M:%S UTC"), inline=True)
+    
     await ctx.send(embed=embed)
 
+@config_status.error
+async def config_status_error(ctx, error):
+    if isinstance(error, commands.NotOwner):
+        await ctx.send("このコマンドはボットのオーナーのみ実行できます。")
+    else:
+        logger.error(f"設定確認エラー: {error}")
+
 if __name__ == "__main__":
     if not config.DISCORD_BOT_TOKEN:
         logger.error("DISCORD_BOT_TOKEN が設定されていません")
@@ -0,0 +1,178 @@
+import logging
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+# 1Kトークンあたりの料金（USD）: (入力, 出力)
+MODEL_PRICES = {
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-4o': (0.0025, 0.01),
+    'gpt-4.1': (0.002, 0.008),
+    'gpt-4.1-mini': (0.0004, 0.0016),
+}
+
+# ルート名
+TEMPLATE_ROUTE = 'template'
+SMALL_ROUTE = 'small'
+DEFAULT_ROUTE = 'default'
+LARGE_ROUTE = 'large'
+
+SYSTEM_PROMPT = "あなたはDiscordの議論内容を要約する専門アシスタントです。"
+
+
+def estimate_tokens(text):
+    """文字種からトークン数を概算（ASCIIは約4文字/トークン、日本語等は約1文字/トークン）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def format_messages(messages):
+    """メッセージを要約プロンプト用の文字列に変換（抽出済みの添付ファイルの内容を含む）"""
+    lines = []
+    for msg in messages:
+        lines.append(f"[{msg['timestamp']}] {msg['author']}: {msg['content']}")
+        for attachment in msg.get('attachment_texts', []):
+            lines.append(f"  📎 {attachment['filename']}:\n{attachment['text']}")
+    return "\n".join(lines)
+
+
+def is_reasoning_model(model):
+    """推論モデル（reasoning_effort を受け付けるモデル）か"""
+    return bool(model) and model.startswith(config.ROUTER_REASONING_MODEL_PREFIXES)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """モデル料金表から費用（USD）を概算"""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return prompt_tokens / 1000 * input_price + completion_tokens / 1000 * output_price
+
+
+class ModelRouter:
+    """メッセージ数・トークン概算・チャンネル優先度からモデルと出力予算を選択"""
+
+    def __init__(self):
+        self.stats = {}
+        if config.ROUTER_LARGE_REASONING_EFFORT and not is_reasoning_model(config.ROUTER_LARGE_MODEL):
+            logger.warning(
+                f"ROUTER_LARGE_MODEL（{config.ROUTER_LARGE_MODEL}）は推論モデルではないため、"
+                f"ROUTER_LARGE_REASONING_EFFORT は無視します"
+            )
+
+    def get_priority(self, channel_name, channel_id=None):
+        """チャンネルの優先度を取得（low / normal / high）"""
+        if channel_id is not None and channel_id in config.CHANNEL_PRIORITIES:
+            return config.CHANNEL_PRIORITIES[channel_id]
+        return config.CHANNEL_PRIORITIES.get(channel_name, 'normal')
+
+    def route(self, channel_name, messages, prompt, channel_id=None, incremental=None):
+        """要約ジョブのルートを決定（incremental: 差分要約のプロンプトか。省略時は設定値）"""
+        if incremental is None:
+            incremental = config.INCREMENTAL_SUMMARY
+        priority = self.get_priority(channel_name, channel_id)
+        prompt_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt)
+
+        # 差分要約では少数のメッセージも累積要約に取り込む必要があるため、テンプレートにしない
+        if len(messages) <= config.ROUTER_TEMPLATE_MAX_MESSAGES and priority != 'high' and not incremental:
+            route = {'name': TEMPLATE_ROUTE, 'model': None, 'max_tokens': 0}
+        elif prompt_tokens >= config.ROUTER_LARGE_MIN_TOKENS and priority != 'low':
+            route = {
+                'name': LARGE_ROUTE,
+                'model': config.ROUTER_LARGE_MODEL,
+                'max_tokens': 2000 if priority == 'high' else 1500,
+                'temperature': 0.5,
+            }
+            if config.ROUTER_LARGE_REASONING_EFFORT and is_reasoning_model(route['model']):
+                # reasoning_effort は推論モデル（o系列など）を指定した場合のみ設定する
+                route['reasoning_effort'] = config.ROUTER_LARGE_REASONING_EFFORT
+        elif prompt_tokens <= config.ROUTER_SMALL_MAX_TOKENS or priority == 'low':
+            route = {
+                'name': SMALL_ROUTE,
+                'model': config.ROUTER_SMALL_MODEL,
+                'max_tokens': 400,
+                'temperature': 0.5,
+            }
+        else:
+            route = {
+                'name': DEFAULT_ROUTE,
+                'model': config.ROUTER_DEFAULT_MODEL,
+                'max_tokens': 1000,
+                'temperature': 0.7,
+            }
+
+        if incremental and route['model']:
+            # 差分要約は新着と累積要約の両方を出力するため、累積要約の上限分を確保
+            route['max_tokens'] = max(route['max_tokens'], config.RUNNING_SUMMARY_MAX_CHARS + 400)
+
+        route['priority'] = priority
+        route['prompt_tokens_estimate'] = prompt_tokens
+        logger.info(
+            f"ルート選択: {channel_name} -> {route['name']} "
+            f"(model: {route['model']}, messages: {len(messages)}, tokens: ~{prompt_tokens}, priority: {priority})"
+        )
+        return route
+
+    def completion_params(self, route, prompt):
+        """Chat Completions API の呼び出しパラメータを生成"""
+        params = {
+            'model': route['model'],
+            'messages': [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            'max_tokens': route['max_tokens'],
+            'temperature': route['temperature'],
+        }
+        if route.get('reasoning_effort'):
+            # 推論モデルは max_tokens / temperature を受け付けない
+            params['reasoning_effort'] = route['reasoning_effort']
+            params['max_completion_tokens'] = params.pop('max_tokens')
+            params.pop('temperature')
+        return params
+
+    def template_summary(self, channel_name, messages):
+        """LLMを使わずにテンプレートで短い要約を作成"""
+        lines = [f"{channel_name} で {len(messages)}件の投稿がありました。"]
+        for msg in messages:
+            content = msg['content'].replace("\n", " ")
+            if len(content) > 120:
+                content = content[:120] + "…"
+            lines.append(f"・{msg['author']}: {content}")
+        return "\n".join(lines)
+
+    def record(self, route, elapsed, prompt_tokens=0, completion_tokens=0):
+        """ルートごとのレイテンシと費用を記録"""
+        stats = self.stats.setdefault(route['name'], {
+            'calls': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'cost': 0.0,
+        })
+        stats['calls'] += 1
+        stats['total_latency'] += elapsed
+        stats['max_latency'] = max(stats['max_latency'], elapsed)
+        stats['prompt_tokens'] += prompt_tokens
+        stats['completion_tokens'] += completion_tokens
+        if route['model']:
+            stats['cost'] += estimate_cost(route['model'], prompt_tokens, completion_tokens)
+
+    def record_response(self, route, started, response):
+        """APIレスポンスの使用量から記録"""
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) if usage else 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) if usage else 0
+        self.record(route, time.monotonic() - started, prompt_tokens or 0, completion_tokens or 0)
+
+    def report(self):
+        """ルートごとのレイテンシ・費用レポートを作成"""
+        lines = []
+        for name, stats in sorted(self.stats.items()):
+            avg_latency = stats['total_latency'] / stats['calls'] if stats['calls'] else 0.0
+            lines.append(
+                f"{name}: {stats['calls']}回, 平均 {avg_latency:.2f}s, 最大 {stats['max_latency']:.2f}s, "
+                f"トークン {stats['prompt_tokens']}+{stats['completion_tokens']}, ${stats['cost']:.4f}"
+            )
+        return lines
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+import config
+
+logger = logging.getLogger(__name__)
+
+# 再起動なしで変更できる設定（ファイルのキー: config の属性名）
+RELOADABLE_KEYS = {
+    'channel_ids': 'CHANNEL_IDS',
+    'summary_interval_hours': 'SUMMARY_INTERVAL_HOURS',
+    'max_messages_per_channel': 'MAX_MESSAGES_PER_CHANNEL',
+    'summary_prompt': 'SUMMARY_PROMPT',
+}
+
+
+def parse_runtime_config(data):
+    """設定ファイルの内容を検証して config の属性名の dict に変換（不正な値は ValueError）"""
+    if not isinstance(data, dict):
+        raise ValueError("設定ファイルはJSONオブジェクトで指定してください")
+    unknown = set(data) - set(RELOADABLE_KEYS)
+    if unknown:
+        raise ValueError(f"再読み込みできない設定です: {', '.join(sorted(unknown))}")
+
+    values = {}
+    if 'channel_ids' in data:
+        raw = data['channel_ids']
+        if isinstance(raw, str):
+            raw = raw.split(',')
+        channels = []
+        for channel in raw:
+            channel = str(channel).strip()
+            if channel:
+                channels.append(int(channel) if channel.isdigit() else channel)
+        values['CHANNEL_IDS'] = channels
+
+    if 'summary_interval_hours' in data:
+        hours = float(data['summary_interval_hours'])
+        if hours <= 0:
+            raise ValueError("summary_interval_hours は正の数で指定してください")
+        values['SUMMARY_INTERVAL_HOURS'] = int(hours) if hours.is_integer() else hours
+
+    if 'max_messages_per_channel' in data:
+        max_messages = int(data['max_messages_per_channel'])
+        if max_messages <= 0:
+            raise ValueError("max_messages_per_channel は正の整数で指定してください")
+        values['MAX_MESSAGES_PER_CHANNEL'] = max_messages
+
+    if 'summary_prompt' in data:
+        prompt = data['summary_prompt']
+        # 要約時に使うプレースホルダー以外が含まれていないか確認
+        prompt.format(channel_name='', start_time='', end_time='', messages='')
+        values['SUMMARY_PROMPT'] = prompt
+
+    return values
+
+
+class RuntimeConfig:
+    """監視対象の設定ファイルを読み込み、変更をまとめて config に反映"""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self.digest = None
+        self.loaded_at = None
+        self.last_error = None
+        self.stat = None
+        # ファイルで上書きしていない項目を元に戻せるよう、起動時の値を保持
+        self.defaults = {name: getattr(config, name) for name in RELOADABLE_KEYS.values()}
+
+    def reload(self):
+        """設定ファイルが変わっていれば反映し、変更された項目 {属性名: (旧, 新)} を返す"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self.version == 0:
+                logger.warning(f"設定ファイルが見つかりません: {self.path}")
+            self.stat = None
+            return {}
+
+        # 更新時刻・サイズが同じなら読み込まない
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self.stat:
+            return {}
+        self.stat = signature
+
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest == self.digest:
+            return {}
+
+        try:
+            values = parse_runtime_config(json.loads(raw.decode('utf-8')))
+        except Exception as e:
+            # 一部だけ反映されないよう、不正な設定は全体を適用しない
+            self.last_error = str(e)
+            logger.error(f"設定ファイルの読み込みエラー（現在の設定を維持）: {e}")
+            return {}
+
+        new_values = {**self.defaults, **values}
+        changes = {
+            name: (getattr(config, name), value)
+            for name, value in new_values.items()
+            if getattr(config, name) != value
+        }
+        # await を挟まずに全項目を置き換えるため、他のタスクから途中の状態は見えない
+        for name, (_, value) in changes.items():
+            setattr(config, name, value)
+
+        self.digest = digest
+        self.version += 1
+        self.loaded_at = datetime.now()
+        self.last_error = None
+        logger.info(
+            f"設定を反映しました（バージョン {self.version}, {digest[:12]}）: "
+            f"{', '.join(changes) or '変更なし'}"
+        )
+        return changes
@@ -1,12 +1,19 @@
-import discord
 import asyncio
 import json
 import logging
 import os
-from datetime import datetime, timedelta
-from openai import OpenAI
+import sys
+import time
+from datetime import datetime, timedelta, timezone
 import aiofiles
 import config
+from model_router import ModelRouter
+from llm_backend import HedgedBackend
+from llm_scheduler import LLMScheduler
+from incremental_summary import RunningSummaryStore, summarize_messages
+from discord_rest import DiscordRestClient
+from attachments import AttachmentExtractor, describe_attachment
+from job_queue import JobQueue, JobPipeline, COLLECT_STAGE, SUMMARIZE_STAGE, DELIVER_STAGE
 
 # ログ設定
 logging.basicConfig(
@@ -22,18 +29,76 @@ logger = logging.getLogger(__name__)
 class DiscordScheduler:
     """間欠実行用のDiscord要約スケジューラー"""
     
-    def __init__(self):
-        self.client = discord.Client(intents=discord.Intents.default())
-        self.openai_client = OpenAI(api_key=config.OPENAI_API_KEY)
+    def __init__(self, rest_only=None):
+        self.rest_only = config.SCHEDULER_REST_ONLY if rest_only is None else rest_only
+        if self.rest_only:
+            self.client = DiscordRestClient(config.DISCORD_BOT_TOKEN)
+        else:
+            # Gateway版は読み込みに時間がかかる discord.py を必要なときだけ import する
+            import discord
+            self.client = discord.Client(intents=discord.Intents.default())
+        self.llm_backend = HedgedBackend()
+        self.channels = {}
+        self.channel_ids = []
+        self.timings = {}
         self.last_run_file = "last_run.json"
+        self.model_router = ModelRouter()
+        self.running_summaries = RunningSummaryStore()
+        self.llm_scheduler = LLMScheduler()
+        self.queue = JobQueue(config.QUEUE_PATH)
+        self.attachment_extractor = AttachmentExtractor() if config.ATTACHMENT_EXTRACTION else None
+        self.summaries = []
         
+    async def login(self):
+        """Discordにログイン"""
+        started = time.monotonic()
+        if self.rest_only:
+            await self.client.login()
+        else:
+            await self.client.login(config.DISCORD_BOT_TOKEN)
+        self.timings['login'] = time.monotonic() - started
+    
+    async def prefetch_channels(self):
+        """対象チャンネルの情報をまとめて取得（1件ずつ順番に待たない）"""
+        started = time.monotonic()
+        if self.rest_only:
+            self.channels = await self.client.prefetch_channels(config.CHANNEL_IDS, config.GUILD_ID)
+        else:
+            results = await asyncio.gather(
+                *(self.client.fetch_channel(channel_id) for channel_id in config.CHANNEL_IDS),
+                return_exceptions=True
+            )
+            self.channels = {}
+            for channel_id, result in zip(config.CHANNEL_IDS, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"チャンネル情報の取得に失敗: {channel_id}: {result}")
+                else:
+                    self.channels[channel_id] = result
+        
+        # 名前で指定したチャンネルもIDに解決し、カーソル・last_run.json はIDで管理する
+        self.channel_ids = []
+        for channel in config.CHANNEL_IDS:
+            if isinstance(channel, int):
+                channel_id = channel
+            elif channel in self.channels:
+                channel_id = self.channels[channel].id
+            else:
+                logger.warning(f"チャンネル名 '{channel}' のIDが見つかりませんでした")
+                continue
+            if channel_id not in self.channel_ids:
+                self.channel_ids.append(channel_id)
+        self.channels = {channel.id: channel for channel in self.channels.values()}
+        self.timings['prefetch'] = time.monotonic() - started
+        return self.channels
+    
     async def get_last_run_times(self):
         """最後の実行時刻を取得"""
         try:
             if os.path.exists(self.last_run_file):
                 async with aiofiles.open(self.last_run_file, 'r') as f:
                     data = json.loads(await f.read())
-                    return {int(k): datetime.fromisoformat(v) for k, v in data.items()}
+                    # 以前の版で名前のまま保存されたキーは読み飛ばす（他のチャンネルの時刻は使う）
+                    return {int(k): datetime.fromisoformat(v) for k, v in data.items() if k.isdigit()}
         except Exception as e:
             logger.error(f"最終実行時刻の読み込みエラー: {e}")
         return {}
@@ -47,13 +112,18 @@ class DiscordScheduler:
         except Exception as e:
             logger.error(f"最終実行時刻の保存エラー: {e}")
     
-    async def fetch_messages_since(self, channel, since_time):
-        """指定時刻以降のメッセージを取得"""
+    async def fetch_messages_since(self, channel, since_time, until=None, raise_on_error=False):
+        """指定時刻以降（until 指定時はそれより前）のメッセージを取得"""
+        # カーソルはUTCのnaiveな日時（discord.py はnaiveな日時をローカル時刻として扱う）
+        since_time = since_time if since_time.tzinfo else since_time.replace(tzinfo=timezone.utc)
+        if until is not None and until.tzinfo is None:
+            until = until.replace(tzinfo=timezone.utc)
         messages = []
         try:
             async for message in channel.history(
                 limit=config.MAX_MESSAGES_PER_CHANNEL,
-                after=since_time
+                after=since_time,
+                before=until
             ):
                 if not message.author.bot:
                     messages.append({
@@ -61,43 +131,26 @@ class DiscordScheduler:
                         'content': message.content,
                         'timestamp': message.created_at.isoformat(),
                         'attachments': [att.url for att in message.attachments],
+                        'attachment_files': [describe_attachment(att) for att in message.attachments],
                     })
         except Exception as e:
             logger.error(f"メッセージ取得エラー (チャンネル: {channel.name}): {e}")
+            if raise_on_error:
+                raise
+        
+        # 添付ファイルの内容を要約対象に追加
+        if self.attachment_extractor:
+            await self.attachment_extractor.enrich(messages)
         
         return sorted(messages, key=lambda x: x['timestamp'])
     
-    async def generate_summary(self, channel_name, messages, start_time, end_time):
-        """GPT APIを使用してメッセージを要約"""
-        if not messages:
-            return "この期間中に新しいメッセージはありませんでした。"
-        
-        messages_text = "\n".join([
-            f"[{msg['timestamp']}] {msg['author']}: {msg['content']}"
-            for msg in messages
-        ])
-        
-        prompt = config.SUMMARY_PROMPT.format(
-            channel_name=channel_name,
-            start_time=start_time.strftime("%Y-%m-%d %H:%M:%S"),
-            end_time=end_time.strftime("%Y-%m-%d %H:%M:%S"),
-            messages=messages_text
+    async def generate_summary(self, channel_name, messages, start_time, end_time, channel_id=None, incremental=None, raise_on_error=False):
+        """GPT APIを使用してメッセージを要約し、（要約, 累積要約）を返す（累積要約は要約の保存後に保存する）"""
+        return await summarize_messages(
+            self.model_router, self.llm_scheduler, self.llm_backend, self.running_summaries,
+            channel_name, messages, start_time, end_time, channel_id,
+            incremental=incremental, raise_on_error=raise_on_error
         )
-        
-        try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "あなたはDiscordの議論内容を要約する専門アシスタントです。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            logger.error(f"要約生成エラー: {e}")
-            return f"要約の生成中にエラーが発生しました: {str(e)}"
     
     async def save_summary(self, channel_name, summary, messages_count, start_time, end_time):
         """要約をファイルに保存"""
@@ -124,7 +177,7 @@ class DiscordScheduler:
             logger.error(f"ファイル保存エラー: {e}")
             return None
     
-    async def post_summary_webhook(self, webhook_url, channel_name, summary, messages_count):
+    async def post_summary_webhook(self, webhook_url, channel_name, summary, messages_count, raise_on_error=False):
         """Webhookを使用して要約を投稿"""
         if not webhook_url:
             return
@@ -151,74 +204,136 @@ class DiscordScheduler:
                         logger.info(f"Webhook投稿成功: {channel_name}")
                     else:
                         logger.error(f"Webhook投稿失敗: {response.status}")
+                        if raise_on_error:
+                            raise RuntimeError(f"Webhook投稿失敗: {response.status}")
         except Exception as e:
             logger.error(f"Webhook投稿エラー: {e}")
+            if raise_on_error:
+                raise
+    
+    async def collect_stage(self, payload):
+        """収集ステージ: メッセージを取得して要約ジョブを作成"""
+        channel_id = payload['channel_id']
+        since_time = datetime.fromisoformat(payload['since'])
+        until_time = datetime.fromisoformat(payload['until'])
+        channel = self.channels.get(channel_id) or await self.client.fetch_channel(channel_id)
+        
+        logger.info(f"チャンネル {channel.name} の要約を開始 (since: {since_time}, until: {until_time})")
+        # カーソルは until まで進めるため、取得も until より前で止める（以降は次回の収集で取得）
+        messages = await self.fetch_messages_since(channel, since_time, until_time, raise_on_error=True)
+        
+        if not messages:
+            logger.info(f"チャンネル {channel.name} に新しいメッセージはありません")
+            return [], None
+        
+        summarize_job = (
+            SUMMARIZE_STAGE,
+            {**payload, 'channel_name': channel.name, 'messages': messages},
+            f"summarize:{channel_id}:{payload['until']}"
+        )
+        # 取得済みメッセージはキューに保存されるため、次回はこの期間を再取得しない
+        return [summarize_job], (f"last_run:{channel_id}", payload['until'])
+    
+    async def summarize_stage(self, payload):
+        """要約ステージ: 要約を生成して保存し、配信ジョブを作成"""
+        since_time = datetime.fromisoformat(payload['since'])
+        until_time = datetime.fromisoformat(payload['until'])
+        messages = payload['messages']
+        
+        summary, running_summary = await self.generate_summary(
+            payload['channel_name'], messages, since_time, until_time, payload['channel_id'], raise_on_error=True
+        )
+        filename = await self.save_summary(
+            payload['channel_name'], summary, len(messages), since_time, until_time
+        )
+        if not filename:
+            raise RuntimeError("要約ファイルの保存に失敗しました")
+        # 要約を保存できた場合のみ累積要約を更新（失敗して再試行するときは前回の累積要約から作り直す）
+        if running_summary:
+            self.running_summaries.save(payload['channel_id'], running_summary)
+        
+        self.summaries.append({
+            'channel_name': payload['channel_name'],
+            'messages_count': len(messages),
+            'summary': summary,
+            'filename': filename
+        })
+        
+        # Webhook投稿（設定されている場合）
+        if not os.getenv('DISCORD_WEBHOOK_URL'):
+            return [], None
+        deliver_job = (
+            DELIVER_STAGE,
+            {
+                'channel_name': payload['channel_name'],
+                'summary': summary,
+                'messages_count': len(messages),
+            },
+            f"deliver:{payload['channel_id']}:{payload['until']}"
+        )
+        return [deliver_job], None
+    
+    async def deliver_stage(self, payload):
+        """配信ステージ: Webhookに要約を投稿"""
+        await self.post_summary_webhook(
+            os.getenv('DISCORD_WEBHOOK_URL'), payload['channel_name'], payload['summary'],
+            payload['messages_count'], raise_on_error=True
+        )
+        return [], None
     
     async def run_summary_job(self):
         """要約ジョブを実行（1回のみ）"""
         logger.info("Discord要約ジョブを開始")
         
         try:
-            await self.client.login(config.DISCORD_BOT_TOKEN)
+            await self.login()
+            await self.prefetch_channels()
+            logger.info(
+                f"起動完了: ログイン {self.timings['login']:.2f}s, "
+                f"チャンネル取得 {self.timings['prefetch']:.2f}s ({len(self.channels)}件)"
+            )
             
-            # 最後の実行時刻を取得
+            # 最後の実行時刻を取得（キューのカーソルを優先）
             last_run_times = await self.get_last_run_times()
             current_time = datetime.utcnow()
             
-            # 各チャンネルを処理
-            summaries = []
-            for channel_id in config.CHANNEL_IDS:
-                try:
-                    channel = await self.client.fetch_channel(channel_id)
-                    if not channel:
-                        logger.warning(f"チャンネルが見つかりません: {channel_id}")
-                        continue
-                    
-                    # 最後の実行時刻を取得、なければ設定時間前から
-                    if channel_id in last_run_times:
-                        since_time = last_run_times[channel_id]
-                    else:
-                        since_time = current_time - timedelta(hours=config.SUMMARY_INTERVAL_HOURS)
-                    
-                    logger.info(f"チャンネル {channel.name} の要約を開始 (since: {since_time})")
-                    
-                    # メッセージを取得
-                    messages = await self.fetch_messages_since(channel, since_time)
-                    
-                    if messages:
-                        # 要約を生成
-                        summary = await self.generate_summary(
-                            channel.name, messages, since_time, current_time
-                        )
-                        
-                        # ファイルに保存
-                        filename = await self.save_summary(
-                            channel.name, summary, len(messages), since_time, current_time
-                        )
-                        
-                        summaries.append({
-                            'channel_name': channel.name,
-                            'messages_count': len(messages),
-                            'summary': summary,
-                            'filename': filename
-                        })
-                        
-                        # Webhook投稿（設定されている場合）
-                        webhook_url = os.getenv('DISCORD_WEBHOOK_URL')
-                        if webhook_url:
-                            await self.post_summary_webhook(
-                                webhook_url, channel.name, summary, len(messages)
-                            )
-                        
-                        # 最後の実行時刻を更新
-                        last_run_times[channel_id] = current_time
-                    else:
-                        logger.info(f"チャンネル {channel.name} に新しいメッセージはありません")
+            # 各チャンネルの収集ジョブを追加（同じ期間の未完了ジョブがあれば追加しない）
+            for channel_id in self.channel_ids:
+                cursor = self.queue.get_cursor(f"last_run:{channel_id}")
+                if cursor:
+                    since_time = datetime.fromisoformat(cursor)
+                elif channel_id in last_run_times:
+                    since_time = last_run_times[channel_id]
+                else:
+                    since_time = current_time - timedelta(hours=config.SUMMARY_INTERVAL_HOURS)
                 
-                except Exception as e:
-                    logger.error(f"チャンネル {channel_id} の処理エラー: {e}")
+                self.queue.enqueue(
+                    COLLECT_STAGE,
+                    {'channel_id': channel_id, 'since': since_time.isoformat(), 'until': current_time.isoformat()},
+                    f"collect:{channel_id}:{since_time.isoformat()}"
+                )
+            
+            # ステージごとのワーカープールで収集・要約・配信を並行処理
+            self.summaries = []
+            pipeline = JobPipeline(
+                self.queue,
+                max_attempts=config.QUEUE_MAX_ATTEMPTS,
+                backoff_seconds=config.QUEUE_BACKOFF_SECONDS,
+                max_wait_seconds=config.QUEUE_MAX_WAIT_SECONDS,
+                attempts_per_run=config.QUEUE_ATTEMPTS_PER_RUN
+            )
+            await pipeline.run({
+                COLLECT_STAGE: (self.collect_stage, config.QUEUE_COLLECT_WORKERS),
+                SUMMARIZE_STAGE: (self.summarize_stage, config.QUEUE_SUMMARIZE_WORKERS),
+                DELIVER_STAGE: (self.deliver_stage, config.QUEUE_DELIVER_WORKERS),
+            })
+            summaries = self.summaries
             
-            # 最後の実行時刻を保存
+            # 最後の実行時刻を保存（他のツールとの互換用）
+            for channel_id in self.channel_ids:
+                cursor = self.queue.get_cursor(f"last_run:{channel_id}")
+                if cursor:
+                    last_run_times[channel_id] = datetime.fromisoformat(cursor)
             await self.save_last_run_times(last_run_times)
             
             logger.info(f"要約ジョブ完了: {len(summaries)}件の要約を生成")
@@ -227,6 +342,22 @@ class DiscordScheduler:
             for summary in summaries:
                 print(f"✅ {summary['channel_name']}: {summary['messages_count']}件のメッセージを要約")
             
+            # 採用されなかったヘッジの完了を待ってから、ルートごとのレイテンシ・費用を出力
+            await self.llm_backend.drain()
+            for line in self.model_router.report():
+                print(f"🧭 {line}")
+            for line in self.llm_scheduler.report():
+                print(f"⏳ LLMキュー待ち {line}")
+            for line in self.llm_backend.report():
+                print(f"🛰️ {line}")
+            
+            # 次回に持ち越したジョブとデッドレターを出力
+            for stage, counts in self.queue.stats().items():
+                if counts.get('pending') or counts.get('running'):
+                    print(f"⏳ {stage}: 再試行待ち {counts.get('pending', 0)}件, 実行中 {counts.get('running', 0)}件")
+            for job in self.queue.dead_letters():
+                print(f"☠️ デッドレター #{job['id']} ({job['stage']}, {job['attempts']}回失敗): {job['last_error']}")
+            
             return summaries
             
         except Exception as e:
@@ -234,6 +365,8 @@ class DiscordScheduler:
             return []
         finally:
             await self.client.close()
+            if self.attachment_extractor:
+                self.attachment_extractor.close()
 
 async def main():
     """メイン実行関数"""
@@ -246,6 +379,11 @@ async def main():
         exit(1)
     
     scheduler = DiscordScheduler()
+    
+    # デッドレターのジョブを再投入してから実行
+    if '--requeue-dead' in sys.argv:
+        print(f"♻️ デッドレターを再投入: {scheduler.queue.requeue_dead()}件")
+    
     summaries = await scheduler.run_summary_job()
     
     print(f"\n🎉 要約完了: {len(summaries)}件")
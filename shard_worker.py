@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import socket
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+import aiohttp
+import config
+from simple_scheduler import SimpleDiscordSummarizer
+
+logger = logging.getLogger(__name__)
+
+
+def channel_key(guild_id, channel_id):
+    """リースのキー（サーバーID:チャンネルID）"""
+    return f"{guild_id}:{channel_id}"
+
+
+def rendezvous_owner(key, workers):
+    """Rendezvousハッシュでチャンネルを担当するワーカーを決定"""
+    if not workers:
+        return None
+    return max(workers, key=lambda worker: hashlib.sha1(f"{worker}:{key}".encode()).hexdigest())
+
+
+class LeaseStore:
+    """複数ワーカーで共有するSQLiteストア（ハートビート・チャンネルリース・最終実行時刻）"""
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "worker_id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, owner TEXT, expires_at REAL NOT NULL DEFAULT 0, "
+                "last_run REAL NOT NULL DEFAULT 0)"
+            )
+
+    def connect(self):
+        """接続を作成（autocommit、トランザクションは明示的に開始）"""
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def heartbeat(self, worker_id):
+        """ワーカーの生存を記録"""
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "INSERT INTO workers (worker_id, heartbeat_at) VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                (worker_id, time.time())
+            )
+
+    def remove_worker(self, worker_id):
+        """ワーカーを登録解除し、保持中のリースを解放"""
+        with closing(self.connect()) as conn:
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+            conn.execute("UPDATE leases SET owner = NULL, expires_at = 0 WHERE owner = ?", (worker_id,))
+
+    def live_workers(self, ttl):
+        """ハートビートが期限内のワーカー一覧"""
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT worker_id FROM workers WHERE heartbeat_at >= ?", (time.time() - ttl,)
+            ).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def try_acquire(self, key, worker_id, lease_seconds, due_before):
+        """期限切れ・未保持かつ実行時刻に達したチャンネルのリースを取得"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT owner, expires_at, last_run FROM leases WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                owner, expires_at, last_run = row
+                if owner and owner != worker_id and expires_at > now:
+                    conn.execute("ROLLBACK")
+                    return None
+                if last_run > due_before:
+                    conn.execute("ROLLBACK")
+                    return None
+            else:
+                last_run = 0
+            conn.execute(
+                "INSERT INTO leases (key, owner, expires_at, last_run) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at",
+                (key, worker_id, now + lease_seconds, last_run)
+            )
+            conn.execute("COMMIT")
+            return last_run
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def renew(self, key, worker_id, lease_seconds):
+        """保持中のリースを延長（失効して他のワーカーに移っていればFalse）"""
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?",
+                (time.time() + lease_seconds, key, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, key, worker_id, last_run):
+        """要約完了を記録してリースを解放"""
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE leases SET last_run = ?, owner = NULL, expires_at = 0 WHERE key = ? AND owner = ?",
+                (last_run, key, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key, worker_id):
+        """要約せずにリースを解放"""
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "UPDATE leases SET owner = NULL, expires_at = 0 WHERE key = ? AND owner = ?",
+                (key, worker_id)
+            )
+
+
+class ShardWorker:
+    """複数サーバー・チャンネルを共有ストアのリースで分担する要約ワーカー"""
+
+    def __init__(self, worker_id, store, guilds=None, poll_seconds=60):
+        self.worker_id = worker_id
+        self.store = store
+        self.guilds = guilds if guilds is not None else config.GUILDS
+        self.poll_seconds = poll_seconds
+        self.interval = timedelta(hours=config.SUMMARY_INTERVAL_HOURS)
+        self.summarizer = SimpleDiscordSummarizer()
+        self.resolved_channels = {}
+        self.channel_names = {}
+
+    async def resolve_guild_channels(self, session, guild):
+        """サーバーごとのチャンネルIDを解決（ワーカー内でキャッシュ）"""
+        guild_id = guild['guild_id']
+        if guild_id not in self.resolved_channels:
+            self.resolved_channels[guild_id] = await self.summarizer.resolve_channel_ids(
+                session, guild['channels'], guild_id
+            )
+        return self.resolved_channels[guild_id]
+
+    async def keep_lease(self, key):
+        """要約中はリースを定期的に延長"""
+        while True:
+            await asyncio.sleep(config.SHARD_LEASE_SECONDS / 3)
+            if not self.store.renew(key, self.worker_id, config.SHARD_LEASE_SECONDS):
+                logger.warning(f"リースを失いました: {key}")
+                return
+
+    async def summarize_channel(self, session, guild, channel_id, last_run):
+        """リース取得済みのチャンネルを要約"""
+        key = channel_key(guild['guild_id'], channel_id)
+        current_time = datetime.now(timezone.utc)
+        if last_run:
+            since_time = datetime.fromtimestamp(last_run, timezone.utc)
+        else:
+            since_time = current_time - self.interval
+
+        keeper = asyncio.create_task(self.keep_lease(key))
+        try:
+            if channel_id not in self.channel_names:
+                self.channel_names[channel_id] = await self.summarizer.fetch_channel_info(session, channel_id)
+            channel_name = self.channel_names[channel_id]
+
+            logger.info(f"[{self.worker_id}] チャンネル {channel_name} の要約を開始 (since: {since_time})")
+            # 取得に失敗した場合は例外でリースを解放し、last_run を進めない
+            messages = await self.summarizer.fetch_messages_since(
+                session, channel_id, since_time, until=current_time, raise_on_error=True
+            )
+
+            summary = None
+            running_summary = None
+            if messages:
+                # 要約の生成に失敗した場合もエラー文を投稿せず、リースを解放して次回に再試行する
+                summary, running_summary = await self.summarizer.generate_summary(
+                    channel_name, messages, since_time, current_time, channel_id, raise_on_error=True
+                )
+
+            # 要約中にリースを失った場合は他のワーカーが担当するため結果を破棄
+            if not self.store.renew(key, self.worker_id, config.SHARD_LEASE_SECONDS):
+                logger.warning(f"[{self.worker_id}] リース失効のため結果を破棄: {channel_name}")
+                return None
+
+            if summary is not None:
+                filename = await self.summarizer.save_summary(
+                    channel_name, summary, len(messages), since_time, current_time, messages
+                )
+                # リースを保持したまま要約を保存できた場合のみ累積要約を更新
+                if filename and running_summary:
+                    self.summarizer.running_summaries.save(channel_id, running_summary)
+                await self.post_summary_webhook(guild.get('webhook_url'), channel_name, summary, len(messages))
+            else:
+                logger.info(f"チャンネル {channel_name} に新しいメッセージはありません")
+                filename = None
+
+            self.store.complete(key, self.worker_id, current_time.timestamp())
+            return {
+                'guild_id': guild['guild_id'],
+                'channel_id': channel_id,
+                'channel_name': channel_name,
+                'messages_count': len(messages),
+                'filename': filename,
+            }
+        except Exception as e:
+            logger.error(f"[{self.worker_id}] チャンネル {channel_id} の処理エラー: {e}")
+            self.store.release(key, self.worker_id)
+            return None
+        finally:
+            keeper.cancel()
+
+    async def post_summary_webhook(self, webhook_url, channel_name, summary, messages_count):
+        """サーバーごとのWebhookに要約を投稿"""
+        if not webhook_url:
+            return
+
+        embed = {
+            "title": f"📊 {channel_name} チャンネル要約",
+            "description": summary,
+            "color": 0x00ff00,
+            "timestamp": datetime.utcnow().isoformat(),
+            "fields": [
+                {"name": "📝 メッセージ数", "value": f"{messages_count}件", "inline": True},
+            ]
+        }
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(webhook_url, json={"embeds": [embed]}) as response:
+                    if response.status != 204:
+                        logger.error(f"Webhook投稿失敗: {response.status}")
+        except Exception as e:
+            logger.error(f"Webhook投稿エラー: {e}")
+
+    async def run_once(self, session):
+        """担当チャンネルのうち実行時刻に達したものを要約"""
+        self.store.heartbeat(self.worker_id)
+        workers = self.store.live_workers(config.SHARD_HEARTBEAT_SECONDS * 3)
+        now = time.time()
+        due_before = now - self.interval.total_seconds()
+        # 担当ワーカーが間に合っていないチャンネルはリース期間を過ぎたら誰でも引き継ぐ
+        overdue_before = due_before - config.SHARD_LEASE_SECONDS
+
+        results = []
+        for guild in self.guilds:
+            for channel_id in await self.resolve_guild_channels(session, guild):
+                key = channel_key(guild['guild_id'], channel_id)
+                if rendezvous_owner(key, workers) == self.worker_id:
+                    last_run = self.store.try_acquire(key, self.worker_id, config.SHARD_LEASE_SECONDS, due_before)
+                else:
+                    last_run = self.store.try_acquire(key, self.worker_id, config.SHARD_LEASE_SECONDS, overdue_before)
+                if last_run is None:
+                    continue
+
+                result = await self.summarize_channel(session, guild, channel_id, last_run)
+                if result:
+                    results.append(result)
+                self.store.heartbeat(self.worker_id)
+        return results
+
+    async def run(self, once=False):
+        """ワーカーを実行（once=Trueなら1周のみ）"""
+        logger.info(f"ワーカー {self.worker_id} を開始（サーバー数: {len(self.guilds)}）")
+        heartbeat = asyncio.create_task(self.heartbeat_loop())
+        try:
+            async with aiohttp.ClientSession() as session:
+                while True:
+                    results = await self.run_once(session)
+                    for result in results:
+                        print(f"✅ [{self.worker_id}] {result['channel_name']}: {result['messages_count']}件のメッセージを要約")
+                    if once:
+                        return results
+                    await asyncio.sleep(self.poll_seconds)
+        finally:
+            heartbeat.cancel()
+            self.store.remove_worker(self.worker_id)
+
+    async def heartbeat_loop(self):
+        """要約中もハートビートを送り続ける"""
+        while True:
+            self.store.heartbeat(self.worker_id)
+            await asyncio.sleep(config.SHARD_HEARTBEAT_SECONDS)
+
+
+def run_worker(worker_id, store_path, once, poll_seconds):
+    """ワーカープロセスのエントリポイント"""
+    worker = ShardWorker(worker_id, LeaseStore(store_path), poll_seconds=poll_seconds)
+    asyncio.run(worker.run(once=once))
+
+
+def main():
+    """メイン実行関数"""
+    parser = argparse.ArgumentParser(description="複数サーバーの要約をワーカー間で分担して実行")
+    parser.add_argument('--worker-id', default=socket.gethostname(), help="ワーカーID（ホストごとに一意）")
+    parser.add_argument('--processes', type=int, default=1, help="このホストで起動するワーカープロセス数")
+    parser.add_argument('--poll-seconds', type=int, default=60, help="担当チャンネルの確認間隔（秒）")
+    parser.add_argument('--once', action='store_true', help="1周だけ実行して終了")
+    args = parser.parse_args()
+
+    if not config.DISCORD_BOT_TOKEN:
+        logger.error("DISCORD_BOT_TOKEN が設定されていません")
+        exit(1)
+
+    if not config.OPENAI_API_KEY:
+        logger.error("OPENAI_API_KEY が設定されていません")
+        exit(1)
+
+    if not config.GUILDS:
+        logger.error("GUILDS_FILE または CHANNEL_IDS が設定されていません")
+        exit(1)
+
+    if args.processes == 1:
+        run_worker(args.worker_id, config.SHARD_STORE, args.once, args.poll_seconds)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(f"{args.worker_id}-{index}", config.SHARD_STORE, args.once, args.poll_seconds)
+        )
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,16 @@ import json
 import logging
 import os
 from datetime import datetime, timedelta, timezone
-import openai
 import aiofiles
 import aiohttp
 import config
-
-# OpenAI設定
-openai.api_key = config.OPENAI_API_KEY
+from model_router import ModelRouter
+from llm_backend import HedgedBackend
+from llm_scheduler import LLMScheduler
+from discord_rest import datetime_to_snowflake
+from incremental_summary import RunningSummaryStore, summarize_messages
+from topic_clustering import TopicClusterer, topic_references
+from attachments import AttachmentExtractor, describe_attachment
 
 # ログ設定
 logging.basicConfig(
@@ -27,6 +30,12 @@ class SimpleDiscordSummarizer:
     
     def __init__(self):
         self.last_run_file = "last_run.json"
+        self.model_router = ModelRouter()
+        self.running_summaries = RunningSummaryStore()
+        self.llm_scheduler = LLMScheduler()
+        self.llm_backend = HedgedBackend()
+        self.topic_clusterer = TopicClusterer() if config.TOPIC_CLUSTERING else None
+        self.attachment_extractor = AttachmentExtractor() if config.ATTACHMENT_EXTRACTION else None
         self.session = None
         self.headers = {
             "Authorization": f"Bot {config.DISCORD_BOT_TOKEN}",
@@ -54,17 +63,19 @@ class SimpleDiscordSummarizer:
         except Exception as e:
             logger.error(f"最終実行時刻の保存エラー: {e}")
     
-    async def resolve_channel_ids(self, session):
+    async def resolve_channel_ids(self, session, channels=None, guild_id=None):
         """チャンネル名をチャンネルIDに解決"""
         resolved_ids = []
+        if channels is None:
+            channels = config.CHANNEL_IDS
         
-        for channel in config.CHANNEL_IDS:
+        for channel in channels:
             if isinstance(channel, int):
                 # 既に数値の場合はそのまま使用
                 resolved_ids.append(channel)
             else:
                 # 文字列の場合は名前からIDを解決
-                channel_id = await self.get_channel_id_by_name(session, channel)
+                channel_id = await self.get_channel_id_by_name(session, channel, guild_id)
                 if channel_id:
                     resolved_ids.append(channel_id)
                 else:
@@ -72,13 +83,14 @@ class SimpleDiscordSummarizer:
         
         return resolved_ids
     
-    async def get_channel_id_by_name(self, session, channel_name):
+    async def get_channel_id_by_name(self, session, channel_name, guild_id=None):
         """チャンネル名からチャンネルIDを取得"""
-        if not config.GUILD_ID:
+        guild_id = guild_id or config.GUILD_ID
+        if not guild_id:
             logger.error("GUILD_IDが設定されていません")
             return None
             
-        url = f"https://discord.com/api/v10/guilds/{config.GUILD_ID}/channels"
+        url = f"https://discord.com/api/v10/guilds/{guild_id}/channels"
         try:
             async with session.get(url, headers=self.headers) as response:
                 if response.status == 200:
@@ -109,18 +121,17 @@ class SimpleDiscordSummarizer:
             logger.error(f"チャンネル情報取得エラー: {e}")
             return f'Channel-{channel_id}'
     
-    async def fetch_messages_since(self, session, channel_id, since_time):
-        """指定時刻以降のメッセージを取得"""
+    async def fetch_messages_since(self, session, channel_id, since_time, until=None, raise_on_error=False):
+        """指定時刻以降（until指定時はその時刻まで）のメッセージを取得"""
         messages = []
         url = f"https://discord.com/api/v10/channels/{channel_id}/messages"
-        
-        # since_timeをDiscord APIの形式に変換（ISO 8601）
-        after_timestamp = since_time.isoformat() + 'Z'
+        if until is not None and until.tzinfo is None:
+            until = until.replace(tzinfo=timezone.utc)
         
         try:
             params = {
                 'limit': min(config.MAX_MESSAGES_PER_CHANNEL, 100),  # Discord APIの制限
-                'after': int(since_time.timestamp() * 1000)  # Snowflake ID形式
+                'after': datetime_to_snowflake(since_time)  # Snowflake ID形式
             }
             
             async with session.get(url, headers=self.headers, params=params) as response:
@@ -135,54 +146,37 @@ class SimpleDiscordSummarizer:
                         # タイムスタンプをパース
                         msg_time = datetime.fromisoformat(msg['timestamp'].replace('Z', '+00:00'))
                         
-                        # since_time以降のメッセージのみ追加
-                        if msg_time > since_time:
+                        # since_time以降（until まで）のメッセージのみ追加
+                        if msg_time > since_time and (until is None or msg_time <= until):
                             messages.append({
                                 'author': msg['author']['username'],
                                 'content': msg['content'],
                                 'timestamp': msg['timestamp'],
                                 'attachments': [att['url'] for att in msg.get('attachments', [])],
+                                'attachment_files': [describe_attachment(att) for att in msg.get('attachments', [])],
                             })
                 else:
-                    logger.error(f"メッセージ取得失敗: {response.status}")
+                    raise RuntimeError(f"メッセージ取得失敗: {response.status}")
                     
         except Exception as e:
             logger.error(f"メッセージ取得エラー (チャンネル: {channel_id}): {e}")
+            if raise_on_error:
+                raise
+        
+        # 添付ファイルの内容を要約対象に追加
+        if self.attachment_extractor:
+            await self.attachment_extractor.enrich(messages)
         
         # 時系列順にソート
         return sorted(messages, key=lambda x: x['timestamp'])
     
-    async def generate_summary(self, channel_name, messages, start_time, end_time):
-        """GPT APIを使用してメッセージを要約"""
-        if not messages:
-            return "この期間中に新しいメッセージはありませんでした。"
-        
-        messages_text = "\n".join([
-            f"[{msg['timestamp']}] {msg['author']}: {msg['content']}"
-            for msg in messages
-        ])
-        
-        prompt = config.SUMMARY_PROMPT.format(
-            channel_name=channel_name,
-            start_time=start_time.strftime("%Y-%m-%d %H:%M:%S"),
-            end_time=end_time.strftime("%Y-%m-%d %H:%M:%S"),
-            messages=messages_text
+    async def generate_summary(self, channel_name, messages, start_time, end_time, channel_id=None, incremental=None, raise_on_error=False):
+        """GPT APIを使用してメッセージを要約し、（要約, 累積要約）を返す（累積要約は要約の保存後に保存する）"""
+        return await summarize_messages(
+            self.model_router, self.llm_scheduler, self.llm_backend, self.running_summaries,
+            channel_name, messages, start_time, end_time, channel_id,
+            incremental=incremental, raise_on_error=raise_on_error
         )
-        
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "あなたはDiscordの議論内容を要約する専門アシスタントです。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            logger.error(f"要約生成エラー: {e}")
-            return f"要約の生成中にエラーが発生しました: {str(e)}"
     
     async def save_summary(self, channel_name, summary, messages_count, start_time, end_time, messages):
         """要約とメッセージをファイルに保存"""
@@ -228,8 +222,8 @@ class SimpleDiscordSummarizer:
                 last_run_times = await self.get_last_run_times()
                 current_time = datetime.utcnow()
                 
-                # 各チャンネルを処理
-                summaries = []
+                # 全チャンネルのメッセージを先に取得（チャンネル横断のトピック集約のため）
+                collected = []
                 for channel_id in resolved_channel_ids:
                     try:
                         # チャンネル名を取得
@@ -248,35 +242,109 @@ class SimpleDiscordSummarizer:
                         logger.info(f"チャンネル {channel_name} の要約を開始 (since: {since_time})")
                         
                         # メッセージを取得
-                        messages = await self.fetch_messages_since(session, channel_id, since_time)
+                        messages = await self.fetch_messages_since(session, channel_id, since_time, until=current_time)
                         
                         if messages:
-                            # 要約を生成
-                            summary = await self.generate_summary(
-                                channel_name, messages, since_time, current_time
-                            )
-                            
-                            # ファイルに保存
-                            filename = await self.save_summary(
-                                channel_name, summary, len(messages), since_time, current_time, messages
-                            )
-                            
-                            summaries.append({
-                                'channel_name': channel_name,
-                                'channel_id': channel_id,
-                                'messages_count': len(messages),
-                                'summary': summary,
-                                'filename': filename
-                            })
-                            
-                            # 最後の実行時刻を更新
-                            last_run_times[channel_id] = current_time
+                            collected.append((channel_id, channel_name, messages, since_time))
                         else:
                             logger.info(f"チャンネル {channel_name} に新しいメッセージはありません")
                     
                     except Exception as e:
                         logger.error(f"チャンネル {channel_id} の処理エラー: {e}")
                 
+                # 複数チャンネルで同じ話題が出ていれば、その話題は1回だけ要約
+                topics = []
+                if self.topic_clusterer and len(collected) >= 2:
+                    try:
+                        topics, remaining = await asyncio.to_thread(
+                            self.topic_clusterer.find_topics,
+                            {channel_id: messages for channel_id, _, messages, _ in collected},
+                            {channel_id: channel_name for channel_id, channel_name, _, _ in collected}
+                        )
+                        collected = [
+                            (channel_id, channel_name, remaining[channel_id], since_time)
+                            for channel_id, channel_name, _, since_time in collected
+                        ]
+                    except Exception as e:
+                        logger.error(f"トピック集約エラー: {e}")
+                
+                # 共通トピックと各チャンネルの要約をまとめて送信し、LLMキューで重み付き公平に処理させる
+                topic_jobs = []
+                for topic in topics:
+                    topic_name = f"共通トピック #{topic['id']}（{', '.join(topic['channel_names'])}）"
+                    since_time = min(since for channel_id, _, _, since in collected if channel_id in topic['channels'])
+                    topic_jobs.append((topic, topic_name, since_time))
+                channel_jobs = [job for job in collected if job[2]]
+                results = await asyncio.gather(
+                    *(
+                        self.generate_summary(topic_name, topic['messages'], since_time, current_time, incremental=False)
+                        for topic, topic_name, since_time in topic_jobs
+                    ),
+                    *(
+                        self.generate_summary(channel_name, messages, since_time, current_time, channel_id)
+                        for channel_id, channel_name, messages, since_time in channel_jobs
+                    ),
+                    return_exceptions=True
+                )
+                channel_results = {
+                    job[0]: result for job, result in zip(channel_jobs, results[len(topic_jobs):])
+                }
+                
+                # 保存はチャンネルの順に行う
+                summaries = []
+                for (topic, topic_name, since_time), result in zip(topic_jobs, results):
+                    if isinstance(result, Exception):
+                        raise result
+                    summary, _ = result
+                    filename = await self.save_summary(
+                        f"topic_{topic['id']}", summary, len(topic['messages']), since_time, current_time, topic['messages']
+                    )
+                    summaries.append({
+                        'channel_name': topic_name,
+                        'channel_id': None,
+                        'messages_count': len(topic['messages']),
+                        'summary': summary,
+                        'filename': filename
+                    })
+                
+                # 各チャンネルを処理
+                for channel_id, channel_name, messages, since_time in collected:
+                    try:
+                        references = topic_references(topics, channel_id)
+                        running_summary = None
+                        if messages:
+                            result = channel_results[channel_id]
+                            if isinstance(result, Exception):
+                                raise result
+                            summary, running_summary = result
+                            if references:
+                                summary = f"{summary}\n\n{references}"
+                        else:
+                            # 全メッセージが共通トピックに含まれた場合は参照のみ
+                            summary = references
+                        
+                        # ファイルに保存
+                        filename = await self.save_summary(
+                            channel_name, summary, len(messages), since_time, current_time, messages
+                        )
+                        # 要約を保存できた場合のみ累積要約を更新（次回の差分要約の前提になるため）
+                        if filename and running_summary:
+                            self.running_summaries.save(channel_id, running_summary)
+                        
+                        summaries.append({
+                            'channel_name': channel_name,
+                            'channel_id': channel_id,
+                            'messages_count': len(messages),
+                            'summary': summary,
+                            'filename': filename
+                        })
+                        
+                        # 最後の実行時刻を更新
+                        last_run_times[channel_id] = current_time
+                    
+                    except Exception as e:
+                        logger.error(f"チャンネル {channel_id} の処理エラー: {e}")
+                
                 # 最後の実行時刻を保存
                 await self.save_last_run_times(last_run_times)
                 
@@ -286,6 +354,15 @@ class SimpleDiscordSummarizer:
                 for summary in summaries:
                     print(f"✅ {summary['channel_name']}: {summary['messages_count']}件のメッセージを要約")
                 
+                # 採用されなかったヘッジの完了を待ってから、ルートごとのレイテンシ・費用を出力
+                await self.llm_backend.drain()
+                for line in self.model_router.report():
+                    print(f"🧭 {line}")
+                for line in self.llm_scheduler.report():
+                    print(f"⏳ LLMキュー待ち {line}")
+                for line in self.llm_backend.report():
+                    print(f"🛰️ {line}")
+                
                 return summaries
                 
             except Exception as e:
@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import sqlite3
+from contextlib import closing
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class HashingEmbedder:
+    """文字n-gramのハッシュによる決定的なローカル埋め込み（API不要・テスト用）"""
+
+    def __init__(self, dim=512, ngram=2):
+        self.dim = dim
+        self.ngram = ngram
+        self.name = f"hashing-{dim}-{ngram}"
+
+    def embed(self, texts):
+        """テキスト一覧を (件数, 次元) の行列に変換"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = text.lower()
+            for i in range(max(1, len(text) - self.ngram + 1)):
+                gram = text[i:i + self.ngram]
+                digest = hashlib.md5(gram.encode('utf-8')).digest()
+                vectors[row, int.from_bytes(digest[:4], 'little') % self.dim] += 1.0
+        return vectors
+
+
+class OpenAIEmbedder:
+    """OpenAI Embeddings API による埋め込み（openai SDK 1.x / 0.28 の両方に対応）"""
+
+    def __init__(self, model=None, batch_size=256):
+        self.model = model or config.TOPIC_EMBEDDING_MODEL
+        self.batch_size = batch_size
+        self.name = f"openai-{self.model}"
+
+    def embed(self, texts):
+        """テキスト一覧を (件数, 次元) の行列に変換"""
+        import openai
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            if hasattr(openai, 'OpenAI'):
+                response = openai.OpenAI(api_key=config.OPENAI_API_KEY).embeddings.create(model=self.model, input=batch)
+                rows.extend(item.embedding for item in response.data)
+            else:
+                response = openai.Embedding.create(model=self.model, input=batch, api_key=config.OPENAI_API_KEY)
+                rows.extend(item['embedding'] for item in response['data'])
+        return np.array(rows, dtype=np.float32)
+
+
+def create_embedder():
+    """設定に応じた埋め込み器を作成"""
+    if config.TOPIC_EMBEDDER == 'openai':
+        return OpenAIEmbedder()
+    return HashingEmbedder()
+
+
+class EmbeddingCache:
+    """内容ハッシュをキーにした埋め込みキャッシュ（SQLite）"""
+
+    def __init__(self, path=None):
+        self.path = path or config.EMBEDDING_CACHE
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def get_many(self, keys):
+        """キャッシュ済みの埋め込みを取得"""
+        found = {}
+        with closing(sqlite3.connect(self.path)) as conn:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" for _ in chunk)
+                for key, blob in conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ):
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        """埋め込みを保存"""
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.astype(np.float32).tobytes()) for key, vector in items]
+            )
+
+
+class TopicClusterer:
+    """複数チャンネルのメッセージを埋め込み、チャンネルをまたぐ共通トピックを抽出"""
+
+    def __init__(self, embedder=None, cache=None):
+        self.embedder = embedder or create_embedder()
+        self.cache = cache or EmbeddingCache()
+
+    def embed_messages(self, texts):
+        """メッセージを埋め込み（同じ内容は一度だけ埋め込む）"""
+        keys = [
+            hashlib.sha256(f"{self.embedder.name}\n{text}".encode('utf-8')).hexdigest()
+            for text in texts
+        ]
+        cached = self.cache.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embedder.embed(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(new_items)
+            cached.update(new_items)
+        logger.info(f"埋め込み: {len(texts)}件（新規 {len(missing)}件、キャッシュ {len(texts) - len(missing)}件）")
+
+        matrix = np.stack([cached[key] for key in keys]).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def find_topics(self, channel_messages, channel_names=None):
+        """{チャンネルID: メッセージ一覧} から共通トピックと残りのメッセージを返す
+
+        同名のチャンネルがあっても混ざらないようIDで区別し、channel_names {チャンネルID: 名前} は表示にのみ使う。
+        """
+        channel_names = channel_names or {}
+        entries = [
+            (channel_id, index, msg)
+            for channel_id, messages in channel_messages.items()
+            for index, msg in enumerate(messages)
+            if len(msg['content'].strip()) >= config.TOPIC_MIN_CHARS
+        ]
+        remaining = {channel_id: list(messages) for channel_id, messages in channel_messages.items()}
+        if len(channel_messages) < 2 or len(entries) < 2:
+            return [], remaining
+
+        matrix = self.embed_messages([msg['content'] for _, _, msg in entries])
+        similarity = matrix @ matrix.T
+
+        # 類似度がしきい値以上のペアを連結成分としてまとめる（Union-Find）
+        parent = list(range(len(entries)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in np.argwhere(np.triu(similarity >= config.TOPIC_SIMILARITY_THRESHOLD, k=1)):
+            root_i, root_j = find(int(i)), find(int(j))
+            if root_i != root_j:
+                parent[root_j] = root_i
+
+        groups = {}
+        for i in range(len(entries)):
+            groups.setdefault(find(i), []).append(i)
+
+        topics = []
+        assigned = {channel_id: set() for channel_id in channel_messages}
+        for members in groups.values():
+            channels = sorted(
+                {entries[i][0] for i in members},
+                key=lambda channel_id: (str(channel_names.get(channel_id, channel_id)), str(channel_id))
+            )
+            if len(channels) < 2 or len(members) < config.TOPIC_MIN_MESSAGES:
+                continue
+
+            members.sort(key=lambda i: entries[i][2]['timestamp'])
+            messages = []
+            for i in members:
+                channel_id, index, msg = entries[i]
+                assigned[channel_id].add(index)
+                messages.append({**msg, 'author': f"{msg['author']} (#{channel_names.get(channel_id, channel_id)})"})
+
+            title = messages[0]['content'].replace("\n", " ")
+            topics.append({
+                'id': len(topics) + 1,
+                'title': title[:40] + ("…" if len(title) > 40 else ""),
+                'channels': channels,
+                'channel_names': [str(channel_names.get(channel_id, channel_id)) for channel_id in channels],
+                'messages': messages,
+            })
+
+        for channel_id, messages in channel_messages.items():
+            remaining[channel_id] = [
+                msg for index, msg in enumerate(messages) if index not in assigned[channel_id]
+            ]
+        if topics:
+            logger.info(f"共通トピックを {len(topics)}件検出")
+        return topics, remaining
+
+
+def topic_references(topics, channel_id):
+    """チャンネル要約に付ける共通トピックへの参照"""
+    lines = []
+    for topic in topics:
+        if channel_id in topic['channels']:
+            others = ", ".join(
+                f"#{name}" for other_id, name in zip(topic['channels'], topic['channel_names']) if other_id != channel_id
+            )
+            lines.append(f"🔗 共通トピック #{topic['id']}「{topic['title']}」（{others} と共通、別途要約）")
+    return "\n".join(lines)